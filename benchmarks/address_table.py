@@ -0,0 +1,79 @@
+# Address-table render benchmark: pages per second for each ADDRESS_TABLE_MODE against the original
+# per-row table (every cell a Paragraph, one ts.add per row), on synthetic territories of several sizes.
+#   python benchmarks/address_table.py [--sizes 500 3000 5000] [--repeat 3]
+import os
+import io
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle
+from reportlab.lib.units import inch
+from reportlab.lib.pagesizes import letter
+from reportlab.lib import colors
+
+from territoryprinter.address_table import build_address_table
+from territoryprinter.render import pdf_paragraph_styles
+from benchmarks.synthetic import synthetic_addresses
+
+def _legacy_table(sorted_addresses, doc_width, styles):
+    # The address table as it was built before the fast modes existed; kept here as the baseline.
+    _, normal_style_rl, street_header_rl_style = styles
+    data_for_table = [[Paragraph("<b>Address</b>", normal_style_rl), Paragraph("<b>Unit</b>", normal_style_rl), Paragraph("<b>City, State Zip</b>", normal_style_rl)]]
+    current_street_header_text = None
+    for street_display, address_display, unit_display, locality_display in zip(
+            sorted_addresses['full_street_display'].tolist(), sorted_addresses['address_display'].tolist(),
+            sorted_addresses['unit_display'].tolist(), sorted_addresses['locality_display'].tolist()):
+        if current_street_header_text != street_display:
+            current_street_header_text = street_display
+            data_for_table.append([Paragraph(f"{current_street_header_text}", street_header_rl_style), "", ""])
+        data_for_table.append([Paragraph(address_display or '-', normal_style_rl), Paragraph(unit_display or '-', normal_style_rl), Paragraph(locality_display or '-', normal_style_rl)])
+    address_rl_table = Table(data_for_table, colWidths=[doc_width*0.45, doc_width*0.15, doc_width*0.35], repeatRows=1, splitByRow=1)
+    ts = TableStyle([
+        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#40466e')), ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+        ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'), ('FONTSIZE', (0,0), (-1,-1), 8),
+        ('BOTTOMPADDING', (0,0), (-1,0), 6), ('LEFTPADDING', (0,0), (-1,-1), 4), ('RIGHTPADDING', (0,0), (-1,-1), 4),
+        ('BOTTOMPADDING', (0,1), (-1,-1), 4), ('TOPPADDING', (0,1), (-1,-1), 4),
+        ('GRID', (0,0), (-1,-1), 0.25, colors.darkgrey), ('LINEBELOW', (0,0), (-1,0), 1, colors.black),
+    ])
+    row_idx_for_style = 0
+    for i, r_data in enumerate(data_for_table):
+        if i == 0: continue
+        if isinstance(r_data[0], Paragraph) and r_data[0].style == street_header_rl_style:
+            ts.add('SPAN', (0, i), (2, i)); ts.add('BACKGROUND', (0, i), (2, i), colors.Color(0.92,0.92,0.92))
+            ts.add('TEXTCOLOR', (0,i), (0,i), colors.black); ts.add('BOTTOMPADDING', (0,i), (2,i), 3); ts.add('TOPPADDING', (0,i), (2,i), 5)
+            ts.add('LINEBELOW', (0, i), (2, i), 0.5, colors.grey); row_idx_for_style = 0
+        elif row_idx_for_style % 2 == 0: ts.add('BACKGROUND', (0,i), (-1,i), colors.white)
+        else: ts.add('BACKGROUND', (0,i), (-1,i), colors.Color(0.96,0.96,0.96))
+        if not (isinstance(r_data[0], Paragraph) and r_data[0].style == street_header_rl_style): row_idx_for_style += 1
+    address_rl_table.setStyle(ts)
+    return address_rl_table
+
+def build_pdf(sorted_addresses, mode):
+    # Title + address table into memory, timed from table construction to the finished PDF; returns (seconds, pages, bytes).
+    styles = pdf_paragraph_styles(); buffer = io.BytesIO()
+    started = time.perf_counter()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, leftMargin=0.5*inch, rightMargin=0.5*inch, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    table = _legacy_table(sorted_addresses, doc.width, styles) if mode == 'legacy' else build_address_table(sorted_addresses, doc.width, styles, mode=mode)
+    doc.build([Paragraph("Benchmark Territory - 1", styles[0]), table])
+    return time.perf_counter() - started, doc.page, len(buffer.getvalue())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Address-table render benchmark (pages per second per table mode).")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 3000, 5000], help="Addresses per synthetic territory.")
+    parser.add_argument("--modes", nargs="+", default=['legacy', 'paragraph', 'fast', 'compact'])
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many builds per mode and size.")
+    args = parser.parse_args(argv)
+    print(f"{'addresses':>9} {'mode':>9} {'pages':>5} {'seconds':>8} {'pages/s':>8} {'KB':>6} {'speedup':>7}")
+    for n_addresses in args.sizes:
+        sorted_addresses = synthetic_addresses(n_addresses); baseline = None
+        for mode in args.modes:
+            seconds, pages, size = min(build_pdf(sorted_addresses, mode) for _ in range(args.repeat))
+            baseline = baseline or seconds
+            print(f"{n_addresses:>9} {mode:>9} {pages:>5} {seconds:>8.3f} {pages / seconds:>8.1f} {size // 1024:>6} {baseline / seconds:>6.1f}x")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
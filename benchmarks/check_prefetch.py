@@ -0,0 +1,94 @@
+# Checks BasemapTileSource.prefetch against the local tile stand-in: tiles shared by territories are fetched
+# once, cached tiles are not requested again, 5xx answers are retried and 404s are not, the request rate stays
+# under the limit, and cancellation stops the batch (also during a retry backoff).
+#   python benchmarks/check_prefetch.py
+# Prints one line per check; exits 1 when any check fails.
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.tile_server import TileStandIn
+
+ZOOM = 16
+CENTER_WM = (-8627000.0, 4725000.0) # Somewhere in the synthetic dataset's area; tile contents do not matter here
+
+def _tile_source(stand_in, cache_folder, max_retries=3):
+    from xyzservices import TileProvider
+    from territoryprinter.tiles import BasemapTileSource
+    provider = TileProvider(name="PrefetchCheck", url=stand_in.url_template, attribution="")
+    return BasemapTileSource(provider, cache_folder=cache_folder, cache_max_bytes=0, timeout=5, max_retries=max_retries)
+
+def _tile_row(n_tiles, row=0):
+    # n_tiles (z, x, y) next to each other, away from the tiles the other checks use.
+    import mercantile as mt
+    origin = mt.tile(*mt.lnglat(*CENTER_WM), ZOOM)
+    return [(ZOOM, origin.x + 40 + i, origin.y + 40 + row) for i in range(n_tiles)]
+
+def check_dedup_and_cache(stand_in, cache_folder):
+    # Two overlapping territories share tiles: the set has fewer tiles than the territories ask for, each is
+    # requested once, and a second prefetch finds all of them in the cache.
+    from shapely.geometry import box
+    from territoryprinter.tiles import basemap_tiles_for_territories
+    x, y = CENTER_WM; polygons = [box(x, y, x + 600, y + 600), box(x + 300, y, x + 900, y + 600)]
+    tiles, requested = basemap_tiles_for_territories(polygons, ZOOM)
+    source = _tile_source(stand_in, cache_folder); before = stand_in.requests
+    cached, downloaded, failed = source.prefetch(tiles, max_workers=4)
+    yield "tiles shared by territories are deduplicated", len(tiles) < requested, f"{requested} requested, {len(tiles)} unique"
+    yield "each unique tile is requested once", (cached, downloaded, failed) == (0, len(tiles), 0) and stand_in.requests - before == len(tiles), \
+        f"{downloaded} downloaded, {stand_in.requests - before} server requests"
+    before = stand_in.requests
+    cached, downloaded, failed = source.prefetch(tiles, max_workers=4)
+    yield "cached tiles are skipped", (cached, downloaded, failed) == (len(tiles), 0, 0) and stand_in.requests == before, \
+        f"{cached} already cached, {stand_in.requests - before} server requests"
+
+def check_retries(stand_in, cache_folder):
+    # A tile answering 503 then 500 is retried until it arrives; a 404 tile fails after one request.
+    retried, missing = _tile_row(2, row=1)
+    stand_in.responses[retried] = [503, 500]; stand_in.responses[missing] = [404] * 5
+    source = _tile_source(stand_in, cache_folder); start = len(stand_in.request_log)
+    cached, downloaded, failed = source.prefetch([retried, missing], max_workers=2)
+    requests = [tile for _, tile in stand_in.request_log[start:]]
+    yield "5xx answers are retried", downloaded == 1 and requests.count(retried) == 3, f"{requests.count(retried)} requests for the 503/500 tile"
+    yield "404 answers are not retried", failed == 1 and requests.count(missing) == 1, f"{requests.count(missing)} requests for the 404 tile"
+
+def check_rate_limit(stand_in, cache_folder, rate=10, n_tiles=20):
+    # Four connections, but requests still arrive no closer than 1/rate apart (with a little timer slack).
+    source = _tile_source(stand_in, cache_folder); start = len(stand_in.request_log)
+    started = time.monotonic(); source.prefetch(_tile_row(n_tiles, row=2), max_workers=4, max_requests_per_second=rate); elapsed = time.monotonic() - started
+    times = sorted(moment for moment, _ in stand_in.request_log[start:]); smallest_gap = min(b - a for a, b in zip(times, times[1:]))
+    yield f"at most {rate} requests per second", smallest_gap >= 0.9 / rate and elapsed >= 0.9 * (n_tiles - 1) / rate, \
+        f"{n_tiles} tiles in {elapsed:.2f}s, smallest gap {smallest_gap * 1000:.0f} ms"
+
+def check_cancellation(stand_in, cache_folder, latency_s=0.2, n_tiles=100):
+    # Cancelling 0.3 s into a slow batch returns at once with most tiles untouched; a tile stuck in its retry
+    # backoff (1 s, 2 s, 4 s) is abandoned too.
+    source = _tile_source(stand_in, cache_folder); stand_in.latency = latency_s
+    try:
+        started = time.monotonic(); cancel_at = started + 0.3
+        cached, downloaded, failed = source.prefetch(_tile_row(n_tiles, row=3), max_workers=4, is_cancelled=lambda: time.monotonic() > cancel_at)
+        elapsed = time.monotonic() - started
+        yield "cancellation stops the batch", elapsed < 0.3 + 2 * latency_s + 0.3 and downloaded + failed < n_tiles // 2, \
+            f"returned after {elapsed:.2f}s with {downloaded} of {n_tiles} downloaded"
+    finally: stand_in.latency = 0
+    stuck = _tile_row(1, row=4)[0]; stand_in.responses[stuck] = [503] * 10
+    started = time.monotonic(); cancel_at = started + 0.5
+    cached, downloaded, failed = source.prefetch([stuck], max_workers=1, is_cancelled=lambda: time.monotonic() > cancel_at)
+    elapsed = time.monotonic() - started
+    yield "cancellation interrupts the retry backoff", elapsed < 1.0 and downloaded == 0, f"returned after {elapsed:.2f}s"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check basemap tile prefetch against a local stand-in tile server.")
+    parser.parse_args(argv)
+    failures = 0
+    with TileStandIn() as stand_in, tempfile.TemporaryDirectory() as cache_folder:
+        for check in (check_dedup_and_cache, check_retries, check_rate_limit, check_cancellation):
+            for name, passed, detail in check(stand_in, os.path.join(cache_folder, check.__name__)):
+                failures += not passed; print(f"{'ok  ' if passed else 'FAIL'} {name}: {detail}")
+    print(f"{failures} check(s) failed." if failures else "All prefetch checks passed.")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
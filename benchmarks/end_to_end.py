@@ -0,0 +1,110 @@
+# End-to-end benchmark: runs `python -m territoryprinter render` on a synthetic dataset against the local tile
+# stand-in (fresh output folder and tile cache per run) and reads the run report for throughput, per-stage
+# timings and peak memory, then compares the result with the baseline recorded on this machine for the same scale
+# and workers. Baselines depend on the machine and the commit, so they live in benchmarks/baseline.json, which
+# is not committed: record one with --save-baseline on the commit to compare against.
+#   python benchmarks/end_to_end.py [--scale small|medium|large] [--workers 1] [--save-baseline]
+# Exits 1 when a metric regresses by more than --tolerance against the baseline.
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+from benchmarks.synthetic import synthetic_dataset
+from benchmarks.tile_server import TileStandIn
+
+SCALES = {'small': (10, 10000), 'medium': (100, 200000), 'large': (1000, 2000000)} # (territories, addresses)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json") # Local to this machine (.gitignore)
+# (metric, True when higher is better); throughput per wall second of the whole run, memory as the largest process peak.
+COMPARED_METRICS = [('territories_per_s', True), ('addresses_per_s', True), ('pages_per_s', True), ('peak_rss_mb', False)]
+
+def run_pipeline(csv_path, kml_path, work_folder, tile_url, workers, prefetch_rate):
+    # One CLI run in a subprocess so its memory peak and start-up are measured like a real run; returns the run report.
+    output_folder = os.path.join(work_folder, "out"); tile_cache = os.path.join(work_folder, "tiles")
+    shutil.rmtree(work_folder, ignore_errors=True); os.makedirs(work_folder)
+    command = [sys.executable, "-m", "territoryprinter", "render", "--csv", csv_path, "--kml", kml_path, "--out", output_folder,
+               "--workers", str(workers), "--tile-url", tile_url, "--tile-cache", tile_cache, "--prefetch-rate", str(prefetch_rate), "--quiet"]
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    wall_s = time.perf_counter() - started
+    if completed.returncode != 0: raise RuntimeError(f"render exited with {completed.returncode}:\n{completed.stdout[-2000:]}\n{completed.stderr[-2000:]}")
+    with open(os.path.join(output_folder, "_run_report.json"), encoding='utf-8') as f: report = json.load(f)
+    return wall_s, report
+
+def current_commit():
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError: return None
+
+def run_metrics(wall_s, report):
+    counts = report['territory_counts']; total = lambda count: counts[count]['total'] if counts.get(count) else 0
+    return {'wall_s': round(wall_s, 3), 'territories_per_s': round(report['succeeded'] / wall_s, 3),
+            'addresses_per_s': round(total('addresses') / wall_s, 1), 'pages_per_s': round(total('pages') / wall_s, 2),
+            'peak_rss_mb': report['peak_rss_mb'], 'pages': total('pages'), 'tiles': total('tiles'),
+            'run_stages_s': {stage: record['wall_s'] for stage, record in report['run_stages'].items()},
+            'territory_stages_p50_s': {stage: timing['wall_s']['p50'] for stage, timing in report['territory_stages'].items() if timing['wall_s']}}
+
+def compare(current, baseline, tolerance):
+    # Prints one line per metric; returns the names of the metrics that regressed beyond the tolerance.
+    regressions = []
+    print(f"{'metric':<20} {'baseline':>12} {'current':>12} {'change':>8}")
+    for metric, higher_is_better in COMPARED_METRICS:
+        old, new = baseline.get(metric), current.get(metric)
+        if not old or new is None: print(f"{metric:<20} {'-':>12} {new!s:>12}"); continue
+        change = (new - old) / old; regressed = change < -tolerance if higher_is_better else change > tolerance
+        if regressed: regressions.append(metric)
+        print(f"{metric:<20} {old:>12} {new:>12} {change:>+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end throughput and memory benchmark against a stored baseline.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default='small', help="Preset size: " + ", ".join(f"{name} {t} territories/{a} addresses" for name, (t, a) in SCALES.items()))
+    parser.add_argument("--territories", type=int, default=None, help="Override the preset's territory count.")
+    parser.add_argument("--addresses", type=int, default=None, help="Override the preset's address count.")
+    parser.add_argument("--workers", type=int, default=1, help="Render processes.")
+    parser.add_argument("--tile-latency-ms", type=float, default=20, help="Latency of the local tile stand-in.")
+    parser.add_argument("--prefetch-rate", type=float, default=0, help="Prefetch request limit per second; 0 (no limit) since the stand-in needs no politeness.")
+    parser.add_argument("--repeat", type=int, default=1, help="Keep the fastest of this many runs.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "territoryprinter_bench"), help="Where synthetic inputs are generated and reused.")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this result as the baseline for its scale and workers.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown or memory growth.")
+    args = parser.parse_args(argv)
+
+    n_territories, n_addresses = SCALES[args.scale]
+    n_territories = args.territories or n_territories; n_addresses = args.addresses or n_addresses
+    key = f"{n_territories}x{n_addresses}_w{args.workers}_lat{args.tile_latency_ms:g}"
+    print(f"Generating/reusing {n_territories} territories and {n_addresses} addresses in {args.work_dir}...")
+    csv_path, kml_path = synthetic_dataset(args.work_dir, n_territories, n_addresses, args.seed)
+    runs = []
+    with TileStandIn(args.tile_latency_ms) as stand_in:
+        for run in range(args.repeat):
+            wall_s, report = run_pipeline(csv_path, kml_path, os.path.join(args.work_dir, f"run_{key}"), stand_in.url_template, args.workers, args.prefetch_rate)
+            runs.append(run_metrics(wall_s, report)); print(f"  run {run + 1}: {wall_s:.2f}s, {report['succeeded']} territories")
+    current = min(runs, key=lambda metrics: metrics['wall_s'])
+    print(f"{key}: {current['wall_s']}s wall, {current['pages']} pages, {current['tiles']} tiles, peak RSS {current['peak_rss_mb']} MB")
+    print("  territory stages p50: " + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in current['territory_stages_p50_s'].items()))
+    print("  run stages: " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in current['run_stages_s'].items()))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f: baselines = json.load(f)
+    if args.save_baseline:
+        baselines[key] = {**current, 'machine': f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs, Python {platform.python_version()}",
+                          'recorded': time.strftime('%Y-%m-%d'), 'commit': current_commit()}
+        with open(args.baseline, 'w', encoding='utf-8') as f: json.dump(baselines, f, indent=1, sort_keys=True); f.write("\n")
+        print(f"Baseline saved for {key} in {args.baseline}"); return 0
+    if key not in baselines: print(f"No baseline for {key}; run with --save-baseline to record one."); return 0
+    print(f"Against the baseline recorded {baselines[key].get('recorded')} at commit {baselines[key].get('commit')} on {baselines[key].get('machine')}:")
+    regressions = compare(current, baselines[key], args.tolerance)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# Per-stage micro-benchmarks on a synthetic dataset. Ingest stages (CSV, boundary parse, basemap zoom, KML parse,
+# projection, display columns, address filter, manifest planning) are timed best-of-N on their own. Render stages
+# (basemap, mask, savefig, table build, PDF build) come from the StageTimer in render_territory over a sample of
+# territories, with tiles served by the local stand-in.
+#   python benchmarks/stages.py [--territories 50] [--addresses 50000] [--sample 10] [--tile-latency-ms 0]
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from territoryprinter import config
+from benchmarks.synthetic import synthetic_dataset
+from benchmarks.tile_server import TileStandIn
+
+def _ignore(*args): pass
+
+def _best_of(repeat, function):
+    # (best seconds, last result)
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter(); result = function(); seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+def ingest_stages(csv_path, kml_path, output_folder, repeat):
+    # [(stage, seconds, items)], plus the inputs the render stages need.
+    import pandas as pd
+    from territoryprinter.engine import CSV_NA_VALUES
+    from territoryprinter.territories import prepare_territories, assign_addresses_to_territories
+    from territoryprinter.addresses import load_and_prepare_kml_data_for_worker, project_addresses, add_address_display_columns
+    from territoryprinter.manifest import MANIFEST_FORMAT_VERSION, plan_incremental_render
+    from territoryprinter.render import render_config_fingerprint
+    from territoryprinter.tiles import choose_basemap_zooms
+    results = []
+    def stage(name, function, items):
+        seconds, result = _best_of(repeat, function); results.append((name, seconds, items(result))); return result
+    df = stage('csv_load', lambda: pd.read_csv(csv_path, keep_default_na=True, na_values=CSV_NA_VALUES), len)
+    territories_wm = stage('boundary_parse', lambda: prepare_territories(df, _ignore), len)
+    territories_wm = stage('basemap_zoom', lambda: choose_basemap_zooms(territories_wm.copy(), _ignore), len)
+    addresses = stage('kml_parse', lambda: load_and_prepare_kml_data_for_worker(kml_path, config.KML_ADDRESS_COMPONENT_TAGS, _ignore), len)
+    projected = stage('projection', lambda: project_addresses(addresses, _ignore), len)
+    projected = stage('display_columns', lambda: add_address_display_columns(projected.copy()), len)
+    address_slices = stage('filter', lambda: assign_addresses_to_territories(projected, territories_wm, _ignore), lambda slices: sum(map(len, slices)))
+    stage('manifest', lambda: plan_incremental_render(territories_wm, projected, address_slices, output_folder, {'version': MANIFEST_FORMAT_VERSION, 'territories': {}},
+                                                      render_config_fingerprint(), force_all=False), lambda plan: len(plan[0]))
+    return results, (territories_wm, projected, address_slices)
+
+def render_stages(territories_wm, projected, address_slices, output_folder, n_sample):
+    # {stage: [seconds per sampled territory]} and summed counts, rendering evenly spaced territories.
+    from territoryprinter.instrumentation import StageTimer, TERRITORY_STAGES
+    from territoryprinter.render import build_render_task, render_territory
+    from territoryprinter.tiles import basemap_tile_config
+    tile_config = basemap_tile_config(); stage_seconds = {stage: [] for stage in TERRITORY_STAGES}; counts = {}
+    n_sample = min(n_sample, len(territories_wm))
+    for position in sorted({round(i * (len(territories_wm) - 1) / max(1, n_sample - 1)) for i in range(n_sample)}):
+        timer = StageTimer(cpu_clock=time.thread_time)
+        result = render_territory(build_render_task(territories_wm, position, projected, address_slices, output_folder, tile_config), _ignore, timer)
+        for stage, record in timer.stages.items(): stage_seconds[stage].append(record['wall_s'])
+        for count, value in result['counts'].items(): counts[count] = counts.get(count, 0) + value
+    return stage_seconds, counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage micro-benchmarks on synthetic territories and addresses.")
+    parser.add_argument("--territories", type=int, default=50)
+    parser.add_argument("--addresses", type=int, default=50000)
+    parser.add_argument("--sample", type=int, default=10, help="Territories rendered for the render-stage timings.")
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many runs per ingest stage.")
+    parser.add_argument("--tile-latency-ms", type=float, default=0, help="Latency of the local tile stand-in.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "territoryprinter_bench"), help="Where synthetic inputs are generated and reused.")
+    parser.add_argument("--json", default=None, help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    csv_path, kml_path = synthetic_dataset(args.work_dir, args.territories, args.addresses, args.seed)
+    from xyzservices import TileProvider
+    with TileStandIn(args.tile_latency_ms) as stand_in, tempfile.TemporaryDirectory() as output_folder:
+        config.BASEMAP_PROVIDER = TileProvider(name="BenchmarkStandIn", url=stand_in.url_template, attribution="")
+        config.BASEMAP_TILE_CACHE_FOLDER = None # Every render-stage tile goes through the stand-in
+        ingest, inputs = ingest_stages(csv_path, kml_path, output_folder, args.repeat)
+        stage_seconds, counts = render_stages(*inputs, output_folder, args.sample)
+
+    print(f"{args.territories} territories, {args.addresses} addresses; ingest best of {args.repeat}, render stages over {len(stage_seconds['basemap'])} territories")
+    print(f"{'stage':<16} {'seconds':>9} {'items':>9} {'items/s':>11}")
+    for name, seconds, items in ingest: print(f"{name:<16} {seconds:>9.4f} {items:>9} {items / seconds if seconds else 0:>11.0f}")
+    print(f"{'stage':<16} {'p50 s':>9} {'max s':>9} {'territories/s':>13}")
+    render = {}
+    for stage, seconds in stage_seconds.items():
+        if not seconds: continue
+        seconds = sorted(seconds); p50 = seconds[len(seconds) // 2]; render[stage] = {'p50_s': p50, 'max_s': seconds[-1]}
+        print(f"{stage:<16} {p50:>9.4f} {seconds[-1]:>9.4f} {1 / p50 if p50 else 0:>13.1f}")
+    print("counts over the sample: " + ", ".join(f"{count} {value}" for count, value in counts.items()))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'territories': args.territories, 'addresses': args.addresses, 'ingest': {name: {'seconds': seconds, 'items': items} for name, seconds, items in ingest},
+                       'render': render, 'render_counts': counts}, f, indent=1)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
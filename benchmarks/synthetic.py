@@ -0,0 +1,124 @@
+# Synthetic inputs for the benchmarks: a territory CSV in the column layout the pipeline reads, an address KML
+# using the KML_ADDRESS_COMPONENT_TAGS SimpleData names, and in-memory address tables. Deterministic per seed.
+#   python benchmarks/synthetic.py --territories 100 --addresses 200000 --out bench_data
+import os
+import csv
+import sys
+import math
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from territoryprinter import config
+from territoryprinter.addresses import ADDRESS_SORT_COLUMNS, add_address_display_columns
+
+STREET_NAMES = ["ELM", "OAK", "MAPLE", "CEDAR", "PINE", "BIRCH", "WILLOW", "ASPEN", "HICKORY", "CHESTNUT", "SYCAMORE", "MAGNOLIA"]
+STREET_TYPES = ["ST", "AVE", "CT", "DR", "LN", "RD", "WAY", "PL"]
+STREET_PREFIXES = ["N", "S", "E", "W"]
+ORIGIN_LON, ORIGIN_LAT = -77.56, 39.08 # Leesburg, VA
+CELL_LON, CELL_LAT = 0.004, 0.003 # One territory per grid cell, about 350 m x 330 m
+STREETS_PER_CELL = 8
+KML_CHUNK_ADDRESSES = 100000
+
+def territory_grid(n_territories):
+    # (columns, rows) of the near-square grid the territories are laid out on.
+    columns = math.ceil(math.sqrt(n_territories)); return columns, math.ceil(n_territories / columns)
+
+def synthetic_territory_polygons(n_territories, vertices=24, seed=0):
+    # One star-shaped (hence simple) polygon per grid cell, filling most of it; the gaps hold unassigned addresses.
+    rng = np.random.default_rng(seed); columns, _ = territory_grid(n_territories); polygons = []
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    for position in range(n_territories):
+        center_lon = ORIGIN_LON + (position % columns + 0.5) * CELL_LON; center_lat = ORIGIN_LAT + (position // columns + 0.5) * CELL_LAT
+        radius = rng.uniform(0.38, 0.49, vertices).tolist()
+        ring = [(round(center_lon + r * CELL_LON * math.cos(a), 7), round(center_lat + r * CELL_LAT * math.sin(a), 7)) for r, a in zip(radius, angles.tolist())]
+        polygons.append(ring + ring[:1])
+    return polygons
+
+def write_territory_csv(path, n_territories, vertices=24, seed=0):
+    # Name, number and a literal coordinate list at TERRITORY_NAME_INDEX, TERRITORY_NUMBER_INDEX and BOUNDARY_COLUMN_INDEX.
+    n_columns = max(config.TERRITORY_NAME_INDEX, config.TERRITORY_NUMBER_INDEX, config.BOUNDARY_COLUMN_INDEX) + 1
+    header = [f"Column {i}" for i in range(n_columns)]
+    header[config.TERRITORY_NAME_INDEX], header[config.TERRITORY_NUMBER_INDEX], header[config.BOUNDARY_COLUMN_INDEX] = "Name", "Number", "Boundary"
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f); writer.writerow(header)
+        for position, ring in enumerate(synthetic_territory_polygons(n_territories, vertices, seed)):
+            row = [""] * n_columns
+            row[config.TERRITORY_NAME_INDEX] = f"Synthetic {position // 26 + 1}{chr(65 + position % 26)}"
+            row[config.TERRITORY_NUMBER_INDEX] = position + 1; row[config.BOUNDARY_COLUMN_INDEX] = str(ring)
+            writer.writerow(row)
+    return path
+
+def _address_components(rng, n_addresses, n_territories):
+    # Points spread over the territory grid; streets run east-west in bands and house numbers grow eastward.
+    columns, rows = territory_grid(n_territories)
+    lon = ORIGIN_LON + rng.random(n_addresses) * columns * CELL_LON; lat = ORIGIN_LAT + rng.random(n_addresses) * rows * CELL_LAT
+    street = ((lat - ORIGIN_LAT) / CELL_LAT * STREETS_PER_CELL).astype(np.int64)
+    house_number = ((lon - ORIGIN_LON) / CELL_LON * 400).astype(np.int64) * 2 + 1 + (street % 2)
+    has_unit = rng.random(n_addresses) < 0.2; has_prefix = street % 10 == 0
+    return {'lon': lon, 'lat': lat, 'street': street, 'house_number': house_number, 'has_unit': has_unit,
+            'unit_number': rng.integers(1, 400, n_addresses), 'has_prefix': has_prefix}
+
+def _simple_data(tag_name, value):
+    return f'<SimpleData name="{tag_name}">{value}</SimpleData>'
+
+def write_address_kml(path, n_addresses, n_territories, seed=0):
+    # Streams placemarks in chunks so two million addresses never sit in memory as strings.
+    tags = {component_key: tag_names[0] for component_key, tag_names in config.KML_ADDRESS_COMPONENT_TAGS.items()}
+    rng = np.random.default_rng(seed)
+    locality = (_simple_data(tags['city'], "LEESBURG") + _simple_data(tags['state'], "VA") + _simple_data(tags['zip'], "20176"))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8" ?>\n<kml xmlns="http://www.opengis.net/kml/2.2"><Document><Folder><name>addresses</name>\n')
+        for chunk_start in range(0, n_addresses, KML_CHUNK_ADDRESSES):
+            n_chunk = min(KML_CHUNK_ADDRESSES, n_addresses - chunk_start); c = _address_components(rng, n_chunk, n_territories)
+            lines = []
+            for i in range(n_chunk):
+                street = int(c['street'][i])
+                prefix = _simple_data(tags['street_prefix'], STREET_PREFIXES[street % 4]) if c['has_prefix'][i] else ""
+                unit = (_simple_data(tags['unit_type'], "APT") + _simple_data(tags['unit_number'], int(c['unit_number'][i]))) if c['has_unit'][i] else ""
+                lines.append(f'<Placemark><name>{chunk_start + i}</name><ExtendedData><SchemaData schemaUrl="#addresses">'
+                             f'{_simple_data(tags["house_number"], int(c["house_number"][i]))}{prefix}'
+                             f'{_simple_data(tags["street_name"], f"{STREET_NAMES[street % len(STREET_NAMES)]} {street // len(STREET_NAMES) + 1}")}'
+                             f'{_simple_data(tags["street_type"], STREET_TYPES[street % len(STREET_TYPES)])}{unit}{locality}'
+                             f'</SchemaData></ExtendedData><Point><coordinates>{c["lon"][i]:.7f},{c["lat"][i]:.7f}</coordinates></Point></Placemark>\n')
+            f.write("".join(lines))
+        f.write('</Folder></Document></kml>\n')
+    return path
+
+def synthetic_dataset(work_dir, n_territories, n_addresses, seed=0):
+    # (csv_path, kml_path) under work_dir, generated once per size and seed and reused afterwards.
+    os.makedirs(work_dir, exist_ok=True)
+    csv_path = os.path.join(work_dir, f"territories_{n_territories}_s{seed}.csv"); kml_path = os.path.join(work_dir, f"addresses_{n_territories}x{n_addresses}_s{seed}.kml")
+    if not os.path.exists(csv_path): write_territory_csv(csv_path + ".tmp", n_territories, seed=seed); os.replace(csv_path + ".tmp", csv_path)
+    if not os.path.exists(kml_path): write_address_kml(kml_path + ".tmp", n_addresses, n_territories, seed=seed); os.replace(kml_path + ".tmp", kml_path)
+    return csv_path, kml_path
+
+def synthetic_addresses(n_addresses, seed=0):
+    # Display columns for n addresses on ~n/40 streets, a fifth of them with units, sorted like a territory table.
+    rng = np.random.default_rng(seed); n_streets = max(1, n_addresses // 40)
+    street = rng.integers(0, n_streets, n_addresses)
+    components = pd.DataFrame({
+        'house_number': (rng.integers(1, 9999, n_addresses)).astype(str),
+        'street_name': [f"{STREET_NAMES[s % len(STREET_NAMES)]} {s // len(STREET_NAMES) + 1}" for s in street],
+        'street_type': [STREET_TYPES[s % len(STREET_TYPES)] for s in street],
+        'unit_type': np.where(rng.random(n_addresses) < 0.2, "APT", None),
+        'unit_number': rng.integers(1, 400, n_addresses).astype(str),
+        'city': "LEESBURG", 'state': "VA", 'zip': "20176",
+    })
+    components.loc[components['unit_type'].isna(), 'unit_number'] = None
+    return add_address_display_columns(components).sort_values(by=ADDRESS_SORT_COLUMNS)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic territory CSV and address KML.")
+    parser.add_argument("--territories", type=int, default=10)
+    parser.add_argument("--addresses", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="bench_data", help="Folder for the CSV and KML (reused if they already exist).")
+    args = parser.parse_args(argv)
+    for path in synthetic_dataset(args.out, args.territories, args.addresses, args.seed): print(path)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# Local stand-in for the basemap tile server: answers every {z}/{x}/{y}.png with a pre-encoded street-map-like
+# PNG after a fixed latency, so the basemap stage runs offline and repeatably. Serves from a background thread.
+# `responses` scripts failures for checks: {(z, x, y): [status, ...]} answers that tile's next requests with those
+# statuses before serving it; `request_log` records (monotonic time, (z, x, y)) for every request.
+#   python benchmarks/tile_server.py --port 8765 --latency-ms 40
+import io
+import sys
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+TILE_SIZE = 256
+TILE_VARIANTS = 16
+
+def synthetic_tile_pngs(n_variants=TILE_VARIANTS, seed=0):
+    # Light background, blocks and a few roads: decodes and compresses like a rendered map tile, not a flat colour.
+    rng = np.random.default_rng(seed); tiles = []
+    for _ in range(n_variants):
+        image = Image.new('RGB', (TILE_SIZE, TILE_SIZE), (242, 239, 233)); draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y = rng.integers(0, TILE_SIZE, 2); w, h = rng.integers(6, 40, 2)
+            draw.rectangle([int(x), int(y), int(x + w), int(y + h)], fill=tuple(int(c) for c in rng.integers(200, 235, 3)), outline=(190, 180, 170))
+        for _ in range(6):
+            points = [tuple(int(v) for v in rng.integers(0, TILE_SIZE, 2)) for _ in range(3)]
+            draw.line(points, fill=(255, 255, 255), width=int(rng.integers(4, 10))); draw.line(points, fill=(250, 210, 150), width=2)
+        buffer = io.BytesIO(); image.save(buffer, 'PNG'); tiles.append(buffer.getvalue())
+    return tiles
+
+class TileStandIn:
+    def __init__(self, latency_ms=0, port=0, host="127.0.0.1"):
+        self.latency = latency_ms / 1000; self.tiles = synthetic_tile_pngs(); self.requests = 0; self._lock = threading.Lock()
+        self.responses = {}; self.request_log = []
+        stand_in = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                try: z, x, y = (int(part) for part in self.path.split('?')[0].strip('/').rsplit('.', 1)[0].split('/'))
+                except ValueError: self.send_error(404); return
+                with stand_in._lock:
+                    stand_in.requests += 1; stand_in.request_log.append((time.monotonic(), (z, x, y)))
+                    scripted = stand_in.responses.get((z, x, y)); status = scripted.pop(0) if scripted else 200
+                if stand_in.latency: time.sleep(stand_in.latency)
+                if status != 200: self.send_error(status); return
+                data = stand_in.tiles[(x * 7 + y * 13 + z) % len(stand_in.tiles)]
+                self.send_response(200); self.send_header('Content-Type', 'image/png'); self.send_header('Content-Length', str(len(data))); self.end_headers()
+                self.wfile.write(data)
+            def log_message(self, *args): pass
+        self.server = ThreadingHTTPServer((host, port), Handler); self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url_template(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/{{z}}/{{x}}/{{y}}.png"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True); self._thread.start(); return self
+
+    def stop(self):
+        self.server.shutdown(); self.server.server_close()
+
+    def __enter__(self): return self.start()
+    def __exit__(self, *exc_info): self.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve synthetic basemap tiles on localhost.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay before every tile response.")
+    args = parser.parse_args(argv)
+    stand_in = TileStandIn(args.latency_ms, args.port)
+    print(f"Serving {stand_in.url_template} (latency {args.latency_ms:g} ms); Ctrl+C to stop.")
+    try: stand_in.server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: stand_in.server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
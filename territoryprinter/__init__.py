@@ -0,0 +1,3 @@
+# Territory map & address-list PDF generator. The GUI lives in map_generator_gui.py; the command line in
+# territoryprinter.cli; both drive territoryprinter.engine.RenderPipeline. territoryprinter.service keeps the
+# inputs loaded and renders single territories on request.
@@ -0,0 +1,200 @@
+# Address table flowables for the territory PDF. Three layouts share the same row model:
+#   'paragraph' - every cell a Paragraph (the original table)
+#   'fast'      - same look, but plain strings measured once with stringWidth; Paragraphs only where a cell must wrap
+#   'compact'   - a multi-column list drawn straight onto the canvas, for very large territories
+import numpy as np
+from reportlab.platypus import Paragraph, Table, TableStyle, Flowable
+from reportlab.platypus.tables import CellStyle
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.lib import colors
+
+from territoryprinter import config
+
+ADDRESS_TABLE_MODES = ('paragraph', 'fast', 'compact')
+HEADER_BACKGROUND = colors.HexColor('#40466e')
+STREET_BACKGROUND = colors.Color(0.92, 0.92, 0.92)
+ZEBRA_BACKGROUND = colors.Color(0.96, 0.96, 0.96)
+CELL_PADDING = 4
+STREET_ROW_LEADING = CellStyle('default').leading # The empty spanned cells keep Table's default leading, which sets the street row height
+
+def address_table_mode(n_addresses):
+    mode = config.ADDRESS_TABLE_MODE
+    if mode == 'auto': return 'fast' if n_addresses >= config.ADDRESS_TABLE_FAST_THRESHOLD else 'paragraph'
+    if mode not in ADDRESS_TABLE_MODES: raise ValueError(f"Unknown ADDRESS_TABLE_MODE: {mode}")
+    return mode
+
+ROW_STREET, ROW_WHITE, ROW_ZEBRA = 0, 1, 2
+
+def address_table_rows(sorted_addresses):
+    # Table layout computed in bulk: new_street flags, each address's table row (row 0 is the column header) and a kind
+    # per body row (street header, white row or zebra row; striping restarts after every street header).
+    streets = sorted_addresses['full_street_display'].to_numpy(dtype=object); n_addresses = len(streets)
+    new_street = np.ones(n_addresses, dtype=bool); new_street[1:] = streets[1:] != streets[:-1]
+    address_rows = np.arange(n_addresses) + 1 + np.cumsum(new_street)
+    street_start = np.maximum.accumulate(np.where(new_street, np.arange(n_addresses), 0))
+    row_kinds = np.full(n_addresses + int(new_street.sum()), ROW_STREET, dtype=np.int8)
+    row_kinds[address_rows - 1] = np.where((np.arange(n_addresses) - street_start) % 2 == 1, ROW_ZEBRA, ROW_WHITE)
+    return new_street, address_rows, row_kinds
+
+def _address_table_style(row_kinds):
+    # Commands for a table whose body rows (row 1 on) have these kinds, built in one list instead of a ts.add per row.
+    commands = [
+        ('BACKGROUND', (0,0), (-1,0), HEADER_BACKGROUND), ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+        ('ALIGN', (0,0), (-1,-1), 'LEFT'), ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'), ('FONTSIZE', (0,0), (-1,-1), 8),
+        ('BOTTOMPADDING', (0,0), (-1,0), 6), ('LEFTPADDING', (0,0), (-1,-1), CELL_PADDING), ('RIGHTPADDING', (0,0), (-1,-1), CELL_PADDING),
+        ('BOTTOMPADDING', (0,1), (-1,-1), 4), ('TOPPADDING', (0,1), (-1,-1), 4),
+        ('GRID', (0,0), (-1,-1), 0.25, colors.darkgrey), ('LINEBELOW', (0,0), (-1,0), 1, colors.black),
+    ]
+    for row in (np.flatnonzero(row_kinds == ROW_STREET) + 1).tolist():
+        commands += [('SPAN', (0, row), (2, row)), ('BACKGROUND', (0, row), (2, row), STREET_BACKGROUND), ('TEXTCOLOR', (0,row), (0,row), colors.black),
+                     ('BOTTOMPADDING', (0,row), (2,row), 3), ('TOPPADDING', (0,row), (2,row), 5), ('LINEBELOW', (0, row), (2, row), 0.5, colors.grey)]
+    commands += [('BACKGROUND', (0,row), (-1,row), ZEBRA_BACKGROUND) for row in (np.flatnonzero(row_kinds == ROW_ZEBRA) + 1).tolist()]
+    return commands
+
+def build_address_table(sorted_addresses, doc_width, styles, mode='paragraph'):
+    # Returns one flowable for the address list (already sorted by ADDRESS_SORT_COLUMNS).
+    _, normal_style_rl, street_header_rl_style = styles
+    if mode == 'compact': return CompactAddressList.from_addresses(sorted_addresses, styles)
+    new_street, address_rows, row_kinds = address_table_rows(sorted_addresses)
+    columns = [sorted_addresses[column].tolist() for column in ('address_display', 'unit_display', 'locality_display')]
+    col_widths = [doc_width*0.45, doc_width*0.15, doc_width*0.35]
+    if mode == 'fast':
+        # Plain string cells draw at the same baseline as a one-line Paragraph when font, size and leading match.
+        # Text too wide for its column (or holding markup) keeps a Paragraph so it still wraps and renders the same.
+        font_name, font_size = normal_style_rl.fontName, normal_style_rl.fontSize
+        cells = []
+        for values, col_width in zip(columns, col_widths):
+            measured = {}; max_width = col_width - 2 * CELL_PADDING; column_cells = []
+            for value in values:
+                text = value or '-'
+                if text not in measured:
+                    measured[text] = text if stringWidth(text, font_name, font_size) <= max_width and '<' not in text and '&' not in text else None
+                column_cells.append(measured[text] if measured[text] is not None else Paragraph(text, normal_style_rl))
+            cells.append(column_cells)
+    else:
+        cells = [[Paragraph(value or '-', normal_style_rl) for value in values] for values in columns]
+
+    header = [Paragraph("<b>Address</b>", normal_style_rl), Paragraph("<b>Unit</b>", normal_style_rl), Paragraph("<b>City, State Zip</b>", normal_style_rl)]
+    body = [None] * len(row_kinds)
+    streets = sorted_addresses['full_street_display'].to_numpy(dtype=object)
+    for header_row, street_display in zip((address_rows[new_street] - 1).tolist(), streets[new_street].tolist()):
+        body[header_row - 1] = [Paragraph(f"{street_display}", street_header_rl_style), "", ""]
+    for address_row, address_cell, unit_cell, locality_cell in zip(address_rows.tolist(), *cells):
+        body[address_row - 1] = [address_cell, unit_cell, locality_cell]
+    if mode == 'fast': return FastAddressTable(header, body, row_kinds, col_widths, normal_style_rl)
+
+    address_rl_table = Table([header] + body, colWidths=col_widths, repeatRows=1, splitByRow=1)
+    address_rl_table.setStyle(TableStyle(_address_table_style(row_kinds)))
+    return address_rl_table
+
+class FastAddressTable(Flowable):
+    # The 'fast' table: every row height is known up front (plain strings are one line, Paragraph cells are measured
+    # once), so each page gets a Table of just the rows that fit. ReportLab's Table.split re-measures and re-styles
+    # all remaining rows on every page instead, which is quadratic in the number of addresses.
+    def __init__(self, header, body, row_kinds, col_widths, normal_style_rl, layout=None, start=0):
+        super().__init__()
+        self.header = header; self.body = body; self.row_kinds = row_kinds; self.col_widths = col_widths
+        self.normal_style_rl = normal_style_rl; self.start = start; self.hAlign = 'CENTER'
+        self.layout = layout or self._measure_rows()
+
+    def _measure_rows(self):
+        # (header height, cumulative body row heights); the paddings match _address_table_style.
+        cell_width = lambda column: self.col_widths[column] - 2 * CELL_PADDING
+        header_height = max(cell.wrap(cell_width(column), 1e6)[1] for column, cell in enumerate(self.header)) + 3 + 6
+        span_width = sum(self.col_widths) - 2 * CELL_PADDING; leading = self.normal_style_rl.leading
+        row_heights = np.full(len(self.body), leading + 8, dtype=float)
+        for row, cells in enumerate(self.body):
+            if isinstance(cells[0], str) and isinstance(cells[1], str) and isinstance(cells[2], str): continue
+            if self.row_kinds[row] == ROW_STREET: row_heights[row] = max(cells[0].wrap(span_width, 1e6)[1], STREET_ROW_LEADING) + 8; continue
+            row_heights[row] = max(leading if isinstance(cell, str) else cell.wrap(cell_width(column), 1e6)[1] for column, cell in enumerate(cells)) + 8
+        return header_height, np.cumsum(row_heights)
+
+    def _height_before(self, row): return self.layout[1][row - 1] if row > 0 else 0.0
+
+    def wrap(self, available_width, available_height):
+        self.width = sum(self.col_widths)
+        self.height = self.layout[0] + self.layout[1][-1] - self._height_before(self.start)
+        return self.width, self.height
+
+    def _table(self, stop):
+        table = Table([self.header] + self.body[self.start:stop], colWidths=self.col_widths, repeatRows=1, splitByRow=1)
+        # Like Table's own split, a street header's LINEBELOW at the foot of the previous page is repeated above this page's first row.
+        carried_line = [('LINEABOVE', (0,1), (2,1), 0.5, colors.grey)] if self.start > 0 and self.row_kinds[self.start - 1] == ROW_STREET else []
+        table.setStyle(TableStyle(_address_table_style(self.row_kinds[self.start:stop]) + carried_line + [
+            ('FONTNAME', (0,1), (-1,-1), self.normal_style_rl.fontName), ('FONTSIZE', (0,1), (-1,-1), self.normal_style_rl.fontSize),
+            ('LEADING', (0,1), (-1,-1), self.normal_style_rl.leading)] +
+            [('LEADING', (0,row), (-1,row), STREET_ROW_LEADING) for row in (np.flatnonzero(self.row_kinds[self.start:stop] == ROW_STREET) + 1).tolist()]))
+        return table
+
+    def split(self, available_width, available_height):
+        # Same rule as Table._splitRows: as many whole rows as fit under the repeated header, at least one.
+        header_height, cumulative_heights = self.layout
+        stop = int(np.searchsorted(cumulative_heights, self._height_before(self.start) + available_height - header_height, side='right'))
+        if stop <= self.start: return []
+        if stop >= len(self.body): return [self._table(len(self.body))]
+        return [self._table(stop), FastAddressTable(self.header, self.body, self.row_kinds, self.col_widths, self.normal_style_rl, self.layout, stop)]
+
+    def draw(self):
+        table = self._table(len(self.body)); table.wrapOn(self.canv, self.width, self.height); table.drawOn(self.canv, 0, 0)
+
+class CompactAddressList(Flowable):
+    # Column-major list (street header, then "house number  unit  locality" lines) drawn with canvas.drawString.
+    # Splits across pages by line count, repeating the current street header at the top of each continuation.
+    def __init__(self, lines, styles, columns=None):
+        super().__init__()
+        self.lines = lines; self.styles = styles; self.columns = columns or config.ADDRESS_COMPACT_COLUMNS
+        _, normal_style_rl, street_header_rl_style = styles
+        self.font_name, self.bold_font_name, self.font_size = normal_style_rl.fontName, street_header_rl_style.fontName, normal_style_rl.fontSize
+        self.line_height = normal_style_rl.leading + 2; self.column_gap = 12
+
+    @classmethod
+    def from_addresses(cls, sorted_addresses, styles):
+        lines = []; current_street = None
+        for street_display, address_display, unit_display, locality_display in zip(
+                sorted_addresses['full_street_display'].tolist(), sorted_addresses['address_display'].tolist(),
+                sorted_addresses['unit_display'].tolist(), sorted_addresses['locality_display'].tolist()):
+            if street_display != current_street: current_street = street_display; lines.append((True, street_display or '-', '', ''))
+            # The street is in the header line, so each address line only needs what precedes it (the house number).
+            house = address_display[:-len(street_display)].strip() if address_display and street_display and address_display.upper().endswith(street_display) else address_display
+            lines.append((False, house or '-', unit_display or '', locality_display or ''))
+        return cls(lines, styles)
+
+    def _rows_per_column(self, available_height): return max(0, int(available_height // self.line_height))
+
+    def wrap(self, available_width, available_height):
+        self.width = available_width
+        self.height = -(-len(self.lines) // self.columns) * self.line_height # Balanced columns; taller than the frame means split
+        return self.width, self.height
+
+    def split(self, available_width, available_height):
+        capacity = self._rows_per_column(available_height) * self.columns
+        if capacity < 2 or len(self.lines) <= capacity: return []
+        if self.lines[capacity - 1][0]: capacity -= 1 # Never leave a street header alone at the bottom
+        rest = self.lines[capacity:]
+        if not rest[0][0]: # Continue the street under a repeated header
+            street = next(line[1] for line in reversed(self.lines[:capacity]) if line[0])
+            rest = [(True, f"{street} (cont.)", '', '')] + rest
+        return [CompactAddressList(self.lines[:capacity], self.styles, self.columns), CompactAddressList(rest, self.styles, self.columns)]
+
+    def _fit(self, text, font_name, max_width):
+        if stringWidth(text, font_name, self.font_size) <= max_width: return text
+        while text and stringWidth(text + "…", font_name, self.font_size) > max_width: text = text[:-1]
+        return text + "…"
+
+    def draw(self):
+        canvas = self.canv; rows = max(1, int(round(self.height / self.line_height)))
+        column_width = (self.width - self.column_gap * (self.columns - 1)) / self.columns
+        slots = (0, column_width * 0.22, column_width * 0.45) # house number, unit, locality offsets
+        for line_index, (is_street, address, unit, locality) in enumerate(self.lines):
+            column, row = divmod(line_index, rows)
+            x = column * (column_width + self.column_gap); y = self.height - (row + 1) * self.line_height
+            if is_street:
+                canvas.setFillColor(STREET_BACKGROUND); canvas.rect(x, y, column_width, self.line_height, stroke=0, fill=1)
+                canvas.setFillColor(colors.black); canvas.setFont(self.bold_font_name, self.font_size)
+                canvas.drawString(x + 2, y + 3, self._fit(address, self.bold_font_name, column_width - 4))
+            else:
+                canvas.setFont(self.font_name, self.font_size)
+                canvas.drawString(x + 2, y + 3, self._fit(address, self.font_name, slots[1] - 4))
+                if unit: canvas.drawString(x + slots[1], y + 3, self._fit(unit, self.font_name, slots[2] - slots[1] - 4))
+                if locality: canvas.drawString(x + slots[2], y + 3, self._fit(locality, self.font_name, column_width - slots[2] - 2))
@@ -0,0 +1,226 @@
+# Address ingest: streaming KML loader, the parsed-address cache and the address table's display columns.
+import os
+import re
+import json
+import hashlib
+import traceback
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import box
+from lxml import etree
+
+# --- Optional: pyarrow for the parsed-address cache ---
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = feather = None
+
+from territoryprinter import config
+from territoryprinter.instrumentation import timed
+
+# --- Helper function for natural sorting ---
+def natural_sort_key(s):
+    if s is None: return ()
+    if not isinstance(s, str): return (s,)
+    parts = re.split('([0-9]+)', s); key_parts = []
+    for text in parts:
+        if text.isdigit(): key_parts.append(int(text))
+        elif text: key_parts.append(text.lower())
+    return tuple(key_parts)
+
+# --- Address display columns & sort keys (computed once over all addresses) ---
+ADDRESS_SORT_COLUMNS = ['full_street_display', 'house_number_prefix', 'house_number_rest_rank']
+ADDRESS_TABLE_COLUMNS = ['full_street_display', 'address_display', 'unit_display', 'locality_display', 'house_number_prefix', 'house_number_rest_rank']
+
+def _join_nonempty(columns, sep=" "):
+    # Vectorized " ".join(filter(None, parts)) over equally indexed string Series.
+    result = columns[0]
+    for column in columns[1:]:
+        both_present = (result != '') & (column != '')
+        result = result.where(~both_present, result + sep) + column
+    return result # Components are stripped at ingest, so no outer whitespace is introduced
+
+def add_address_display_columns(gdf):
+    # Adds the address table's display columns plus a numeric natural-sort key for house numbers:
+    # sorting by (full_street_display, house_number_prefix, house_number_rest_rank) orders rows as
+    # sorting by (full_street_display, natural_sort_key(house_number)) does.
+    if gdf.empty:
+        for column in ADDRESS_TABLE_COLUMNS: gdf[column] = pd.Series(dtype=object)
+        return gdf
+    component = lambda key: (gdf[key] if key in gdf.columns else pd.Series(None, index=gdf.index)).astype(object).where(lambda c: c.notna(), '').astype(str)
+    street_parts = [component('street_prefix'), component('street_name'), component('street_type'), component('street_suffix')]
+    house_number = component('house_number')
+    gdf['full_street_display'] = _join_nonempty(street_parts).str.upper()
+    gdf['address_display'] = _join_nonempty([house_number] + street_parts)
+    gdf['unit_display'] = _join_nonempty([component('unit_type'), component('unit_number')])
+    gdf['locality_display'] = _join_nonempty([component('city'), _join_nonempty([component('state'), component('zip')])], sep=", ")
+
+    # House numbers repeat heavily (apartments), so the keys are computed per distinct value.
+    house_number_codes, house_number_values = pd.factorize(house_number)
+    house_number_parts = pd.Series(house_number_values, dtype=object).str.extract(r'^(\d*)(.*)$', expand=True)
+    prefix_values = pd.to_numeric(house_number_parts[0], errors='coerce').to_numpy() # Non-numeric house numbers (NaN) sort last
+    rest_keys = [natural_sort_key(value) for value in house_number_parts[1]]
+    rank_by_key = {key: rank for rank, key in enumerate(sorted(set(rest_keys)))}
+    rest_rank_values = np.array([rank_by_key[key] for key in rest_keys], dtype=np.int64)
+    gdf['house_number_prefix'] = prefix_values[house_number_codes]; gdf['house_number_rest_rank'] = rest_rank_values[house_number_codes]
+    return gdf
+
+# --- KML Loading Function (for worker thread) ---
+KML_NAMESPACE = '{http://www.opengis.net/kml/2.2}'
+KML_PLACEMARK_TAG = KML_NAMESPACE + 'Placemark'
+KML_SIMPLEDATA_TAG = KML_NAMESPACE + 'SimpleData'
+KML_COORDINATES_PATH = f'.//{KML_NAMESPACE}Point/{KML_NAMESPACE}coordinates'
+KML_NAME_PATH = f'./{KML_NAMESPACE}name'
+KML_LOAD_LOG_EVERY = 100000
+
+def empty_address_gdf(crs="EPSG:4326"):
+    return gpd.GeoDataFrame(geometry=[], crs=crs)
+
+def _resolve_address_components(simple_data, component_items):
+    # simple_data is a {SimpleData name: stripped text} dict read in one pass over the placemark.
+    values = {}
+    for component_key, tag_names_list in component_items:
+        component_value = None
+        for tag_name in tag_names_list:
+            value_found = simple_data.get(tag_name)
+            if value_found: component_value = value_found; break
+        values[component_key] = component_value
+    return values
+
+def load_and_prepare_kml_data_for_worker(kml_file_path, component_tags_map, log_emitter, bbox=None):
+    # Streams placemarks with iterparse, clearing each element once read, and fills columnar
+    # arrays directly. bbox=(min_lon, min_lat, max_lon, max_lat) drops addresses outside it at ingest.
+    log_emitter(f"  Loading KML file (streaming): {kml_file_path}...")
+    component_items = list(component_tags_map.items())
+    use_name_fallback = "__name__" in component_tags_map.get('house_number', [])
+    columns = {component_key: [] for component_key, _ in component_items}
+    lons, lats = [], []
+    placemark_count = outside_bbox_count = 0
+    try:
+        with open(kml_file_path, 'rb') as f:
+            for _, placemark in etree.iterparse(f, events=('end',), tag=KML_PLACEMARK_TAG, huge_tree=True):
+                placemark_count += 1
+                if placemark_count % KML_LOAD_LOG_EVERY == 0: log_emitter(f"    - Read {placemark_count} placemarks...")
+                try:
+                    point_element = placemark.find(KML_COORDINATES_PATH)
+                    if point_element is None or not point_element.text: continue
+                    try:
+                        lon_str, lat_str = point_element.text.strip().split(',')[:2]; lon, lat = float(lon_str), float(lat_str)
+                    except ValueError: continue
+                    if bbox is not None and not (bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]):
+                        outside_bbox_count += 1; continue
+                    simple_data = {}
+                    for simple_data_element in placemark.iter(KML_SIMPLEDATA_TAG):
+                        simple_data.setdefault(simple_data_element.get('name'), (simple_data_element.text or '').strip())
+                    values = _resolve_address_components(simple_data, component_items)
+                    if not values.get('house_number') and use_name_fallback:
+                        name_el = placemark.find(KML_NAME_PATH)
+                        if name_el is not None and name_el.text and name_el.text.strip().isdigit(): values['house_number'] = name_el.text.strip()
+                    if not values.get('house_number'): continue
+                    lons.append(lon); lats.append(lat)
+                    for component_key, value in values.items(): columns[component_key].append(value)
+                finally:
+                    placemark.clear()
+                    while placemark.getprevious() is not None: del placemark.getparent()[0]
+
+        log_emitter(f"    - Found {placemark_count} total placemarks.")
+        if bbox is not None: log_emitter(f"    - Dropped {outside_bbox_count} placemarks outside the territory bounding box.")
+        log_emitter(f"    - Extracted {len(lons)} address entries with house numbers.")
+        if not lons:
+            log_emitter("    - No address entries could be extracted."); return empty_address_gdf()
+        geometry = gpd.points_from_xy(lons, lats, crs="EPSG:4326")
+        return gpd.GeoDataFrame({'geometry': geometry, **columns}, geometry='geometry', crs="EPSG:4326")
+    except FileNotFoundError: log_emitter(f"  ERROR: KML file not found: {kml_file_path}"); return empty_address_gdf()
+    except etree.XMLSyntaxError as xml_err: log_emitter(f"  ERROR: KML XML Syntax: {xml_err}"); return empty_address_gdf()
+    except Exception as e: log_emitter(f"  ERROR KML parsing: {e}\n{traceback.format_exc()}"); return empty_address_gdf()
+
+# --- Parsed Address Cache (Feather, keyed by KML fingerprint + component tags) ---
+def address_cache_folder(output_folder):
+    return os.path.join(output_folder, config.ADDRESS_CACHE_FOLDER_NAME)
+
+def invalidate_address_cache(output_folder, log_emitter=None):
+    cache_folder = address_cache_folder(output_folder); removed = 0
+    if os.path.isdir(cache_folder):
+        for file_name in os.listdir(cache_folder):
+            if file_name.endswith('.feather'): os.remove(os.path.join(cache_folder, file_name)); removed += 1
+    if log_emitter: log_emitter(f"  Address cache cleared ({removed} file(s) removed from {cache_folder}).")
+    return removed
+
+def _file_sha256(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''): digest.update(chunk)
+    return digest.hexdigest()
+
+def address_cache_key(kml_file_path, component_tags_map):
+    stat = os.stat(kml_file_path)
+    return json.dumps({'version': config.ADDRESS_CACHE_FORMAT_VERSION, 'path': os.path.abspath(kml_file_path),
+                       'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': _file_sha256(kml_file_path),
+                       'tags': component_tags_map, 'crs': config.TARGET_CRS}, sort_keys=True)
+
+def _address_cache_file(cache_folder, kml_file_path):
+    # One entry per KML path; the full key lives in the file's schema metadata and is compared on read.
+    path_hash = hashlib.sha256(os.path.abspath(kml_file_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_folder, f"addresses_{path_hash}.feather")
+
+def read_address_cache(cache_file, cache_key):
+    if not os.path.exists(cache_file): return None, "no cache file"
+    table = feather.read_table(cache_file, memory_map=True)
+    stored_key = (table.schema.metadata or {}).get(b'territoryprinter_cache_key', b'').decode('utf-8')
+    if stored_key != cache_key: return None, "KML or component tags changed"
+    df = table.to_pandas()
+    geometry = gpd.points_from_xy(df.pop('_x'), df.pop('_y'), crs=config.TARGET_CRS)
+    return gpd.GeoDataFrame({'geometry': geometry, **{c: df[c] for c in df.columns}}, geometry='geometry', crs=config.TARGET_CRS), None
+
+def write_address_cache(cache_file, cache_key, projected_gdf):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    columns = {c: projected_gdf[c] for c in projected_gdf.columns if c != projected_gdf.geometry.name}
+    columns['_x'] = projected_gdf.geometry.x.to_numpy(); columns['_y'] = projected_gdf.geometry.y.to_numpy()
+    table = pa.Table.from_pandas(pd.DataFrame(columns), preserve_index=False)
+    table = table.replace_schema_metadata({b'territoryprinter_cache_key': cache_key.encode('utf-8')})
+    temp_file = cache_file + ".tmp"
+    feather.write_feather(table, temp_file, compression='uncompressed') # Uncompressed so reads can memory-map
+    os.replace(temp_file, cache_file)
+
+def project_addresses(gdf_original_crs, log_emitter):
+    if gdf_original_crs is None or gdf_original_crs.empty: return empty_address_gdf(config.TARGET_CRS)
+    log_emitter(f"  Projecting all KML addresses to {config.TARGET_CRS} (one-time)...")
+    try: return gdf_original_crs.to_crs(config.TARGET_CRS)
+    except Exception as proj_err: log_emitter(f"  ERROR projecting KML data: {proj_err}"); return empty_address_gdf(config.TARGET_CRS)
+
+def clip_addresses_to_bbox(projected_gdf, bbox):
+    if bbox is None or projected_gdf.empty: return projected_gdf
+    min_x, min_y, max_x, max_y = gpd.GeoSeries([box(*bbox)], crs="EPSG:4326").to_crs(config.TARGET_CRS).total_bounds
+    return projected_gdf.loc[projected_gdf.geometry.x.between(min_x, max_x) & projected_gdf.geometry.y.between(min_y, max_y)]
+
+def _load_and_project(kml_file_path, component_tags_map, log_emitter, bbox, timer):
+    with timed(timer, 'kml_load'): gdf = load_and_prepare_kml_data_for_worker(kml_file_path, component_tags_map, log_emitter, bbox=bbox)
+    with timed(timer, 'projection'): return project_addresses(gdf, log_emitter)
+
+def load_projected_kml_addresses(kml_file_path, component_tags_map, cache_folder, log_emitter, bbox=None, timer=None):
+    # Addresses in TARGET_CRS. With the cache on, the full (unclipped) address set is cached so a
+    # changed territory extent does not invalidate it; the bbox is then applied to the cached columns.
+    # Only when no cache will be written is the bbox applied while parsing (lower peak memory on a big KML).
+    # timer (a StageTimer) gets 'kml_load' and 'projection' stages; a cache hit counts as 'kml_load'.
+    if not config.ADDRESS_CACHE_ENABLED or cache_folder is None:
+        return _load_and_project(kml_file_path, component_tags_map, log_emitter, bbox, timer)
+    if feather is None:
+        log_emitter("  Address cache disabled: pyarrow is not installed.")
+        return _load_and_project(kml_file_path, component_tags_map, log_emitter, bbox, timer)
+    cache_file = _address_cache_file(cache_folder, kml_file_path); cache_key = None
+    try:
+        cache_key = address_cache_key(kml_file_path, component_tags_map)
+        with timed(timer, 'kml_load'): cached_gdf, miss_reason = read_address_cache(cache_file, cache_key)
+        if cached_gdf is not None:
+            log_emitter(f"  Address cache hit: {cache_file} ({len(cached_gdf)} addresses).")
+            return clip_addresses_to_bbox(cached_gdf, bbox)
+        log_emitter(f"  Address cache miss ({miss_reason}); parsing KML.")
+    except FileNotFoundError: pass # Reported by the loader below
+    except Exception as cache_err: log_emitter(f"  Address cache unreadable ({cache_err}); parsing KML.")
+    projected_gdf = _load_and_project(kml_file_path, component_tags_map, log_emitter, None if cache_key is not None else bbox, timer)
+    if cache_key is not None and not projected_gdf.empty:
+        try: write_address_cache(cache_file, cache_key, projected_gdf); log_emitter(f"  Address cache written: {cache_file}")
+        except Exception as cache_err: log_emitter(f"  Could not write address cache: {cache_err}")
+    return clip_addresses_to_bbox(projected_gdf, bbox)
@@ -0,0 +1,125 @@
+# Combined booklet: every territory PDF in CSV order behind a contents page, one bookmark per territory.
+# Pages are copied object by object straight into the output file, so only one territory PDF is open at a
+# time and memory stays flat however many territories and address rows the book holds.
+import io
+import os
+from xml.sax.saxutils import escape
+
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle
+from reportlab.lib.units import inch
+from reportlab.lib.pagesizes import letter
+
+# --- Optional: pypdf for reading the territory PDFs ---
+try:
+    from pypdf import PdfReader
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, StreamObject, TextStringObject
+except ImportError:
+    PdfReader = None
+
+from territoryprinter.render import pdf_paragraph_styles
+
+CATALOG_ID, PAGE_TREE_ID, OUTLINES_ID = 1, 2, 3
+INHERITABLE_PAGE_KEYS = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+def booklet_available(): return PdfReader is not None
+
+def _shared_font_key(font):
+    # Standard-14 fonts (no embedded program) are identical across territory PDFs; one copy serves them all.
+    if font.get('/Type') != '/Font' or '/FontDescriptor' in font or '/DescendantFonts' in font: return None
+    encoding = font.get('/Encoding')
+    if encoding is not None and not isinstance(encoding, NameObject): return None
+    return (font.get('/Subtype'), font.get('/BaseFont'), encoding)
+
+class BookletWriter:
+    def __init__(self, path):
+        self.path = path; self.temp_path = path + ".part"
+        self._file = open(self.temp_path, 'wb'); self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._offsets = {}; self._next_id = OUTLINES_ID + 1
+        self._shared_fonts = {}; self._page_ids = []
+        self.entries = [] # (title, index of first page, page count)
+
+    def _new_id(self):
+        self._next_id += 1; return self._next_id - 1
+
+    def _write_object(self, obj_id, body):
+        self._offsets[obj_id] = self._file.tell()
+        self._file.write(b"%d 0 obj\n" % obj_id); self._file.write(body); self._file.write(b"\nendobj\n")
+
+    def _serialize(self, obj, ref_id):
+        # ref_id maps a source IndirectObject to its object number in the booklet.
+        if isinstance(obj, IndirectObject): return b"%d 0 R" % ref_id(obj)
+        if isinstance(obj, StreamObject):
+            entries = DictionaryObject({key: value for key, value in obj.items() if key != '/Length'})
+            return self._serialize(entries, ref_id)[:-2] + b"/Length %d>>\nstream\n" % len(obj._data) + obj._data + b"\nendstream"
+        if isinstance(obj, DictionaryObject):
+            return b"<<" + b"".join(self._serialize(key, ref_id) + b" " + self._serialize(value, ref_id) + b"\n" for key, value in obj.items()) + b">>"
+        if isinstance(obj, ArrayObject): return b"[" + b" ".join(self._serialize(item, ref_id) for item in obj) + b"]"
+        buffer = io.BytesIO(); obj.write_to_stream(buffer); return buffer.getvalue()
+
+    def _copy_pages(self, reader):
+        # Copies every object reachable from the reader's pages; each page is re-parented onto the booklet page tree.
+        id_map = {}; queue = []; page_ids = []
+        def ref_id(ref):
+            if ref.idnum not in id_map:
+                font_key = None
+                target = ref.get_object()
+                if isinstance(target, DictionaryObject) and not isinstance(target, StreamObject): font_key = _shared_font_key(target)
+                if font_key is not None and font_key in self._shared_fonts: id_map[ref.idnum] = self._shared_fonts[font_key]
+                else:
+                    id_map[ref.idnum] = self._new_id(); queue.append(ref)
+                    if font_key is not None: self._shared_fonts[font_key] = id_map[ref.idnum]
+            return id_map[ref.idnum]
+        for page in reader.pages:
+            page_id = self._new_id(); page_ids.append(page_id)
+            if page.indirect_reference is not None: id_map[page.indirect_reference.idnum] = page_id
+        for page, page_id in zip(reader.pages, page_ids):
+            # Annotations and article beads point back into the source page tree; territory pages have neither.
+            page_dict = DictionaryObject({key: value for key, value in page.items() if key not in ('/Parent', '/Annots', '/B')})
+            for key in INHERITABLE_PAGE_KEYS:
+                if key not in page_dict and page.get_inherited(key, None) is not None: page_dict[NameObject(key)] = page.get_inherited(key, None)
+            self._write_object(page_id, self._serialize(page_dict, ref_id)[:-2] + b"/Parent %d 0 R>>" % PAGE_TREE_ID)
+            while queue:
+                ref = queue.pop(); self._write_object(id_map[ref.idnum], self._serialize(ref.get_object(), ref_id))
+        return page_ids
+
+    def add_pdf(self, title, pdf_path):
+        page_ids = self._copy_pages(PdfReader(pdf_path))
+        self.entries.append((title, len(self._page_ids), len(page_ids))); self._page_ids.extend(page_ids)
+
+    def _contents_pdf(self, contents_pages):
+        # Contents page(s); page numbers count the contents pages themselves.
+        title_rl_style, normal_style_rl, _ = pdf_paragraph_styles()
+        rows = [[Paragraph(escape(title), normal_style_rl), Paragraph(str(contents_pages + first_page + 1), normal_style_rl)] for title, first_page, _ in self.entries]
+        buffer = io.BytesIO()
+        doc = SimpleDocTemplate(buffer, pagesize=letter, leftMargin=0.5*inch, rightMargin=0.5*inch, topMargin=0.5*inch, bottomMargin=0.5*inch, title="Contents")
+        table = Table(rows, colWidths=[doc.width*0.85, doc.width*0.15], repeatRows=0)
+        table.setStyle(TableStyle([('ALIGN', (1,0), (1,-1), 'RIGHT'), ('LINEBELOW', (0,0), (-1,-1), 0.25, '#cccccc'), ('VALIGN', (0,0), (-1,-1), 'MIDDLE')]))
+        doc.build([Paragraph("Contents", title_rl_style), table])
+        buffer.seek(0); return PdfReader(buffer)
+
+    def close(self):
+        # Writes contents, page tree, bookmarks, catalog and cross-reference table, then moves the file into place.
+        contents_pages = 1
+        contents = self._contents_pdf(contents_pages)
+        if len(contents.pages) != contents_pages: contents_pages = len(contents.pages); contents = self._contents_pdf(contents_pages)
+        kids = self._copy_pages(contents) + self._page_ids
+        self._write_object(PAGE_TREE_ID, b"<</Type /Pages /Count %d /Kids [%s]>>" % (len(kids), b" ".join(b"%d 0 R" % kid for kid in kids)))
+        outline_ids = [self._new_id() for _ in self.entries]
+        for position, (title, first_page, _) in enumerate(self.entries):
+            title_buffer = io.BytesIO(); TextStringObject(title).write_to_stream(title_buffer)
+            links = b"".join([b"/Prev %d 0 R " % outline_ids[position - 1] if position > 0 else b"",
+                              b"/Next %d 0 R " % outline_ids[position + 1] if position + 1 < len(outline_ids) else b""])
+            self._write_object(outline_ids[position], b"<</Title %s /Parent %d 0 R %s/Dest [%d 0 R /Fit]>>" % (
+                title_buffer.getvalue(), OUTLINES_ID, links, kids[contents_pages + first_page]))
+        if outline_ids: self._write_object(OUTLINES_ID, b"<</Type /Outlines /First %d 0 R /Last %d 0 R /Count %d>>" % (outline_ids[0], outline_ids[-1], len(outline_ids)))
+        else: self._write_object(OUTLINES_ID, b"<</Type /Outlines /Count 0>>")
+        self._write_object(CATALOG_ID, b"<</Type /Catalog /Pages %d 0 R /Outlines %d 0 R /PageMode /UseOutlines>>" % (PAGE_TREE_ID, OUTLINES_ID))
+        xref_offset = self._file.tell()
+        self._file.write(b"xref\n0 %d\n0000000000 65535 f \n" % self._next_id)
+        self._file.write(b"".join(b"%010d 00000 n \n" % self._offsets[obj_id] for obj_id in range(1, self._next_id)))
+        self._file.write(b"trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (self._next_id, CATALOG_ID, xref_offset))
+        self._file.close(); os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.temp_path): os.remove(self.temp_path)
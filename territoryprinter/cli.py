@@ -0,0 +1,122 @@
+# Headless entry point: `python -m territoryprinter render --csv ... --kml ... --out ...`.
+# Writes one JSON object per line to stdout (log, progress, kml_loaded, territory, eta, finished, summary).
+# `serve` keeps the inputs loaded and renders single territories on request (see service.py).
+# Only argparse/json are imported up front; the pipeline's libraries load when their stage runs.
+import argparse
+import json
+import os
+import signal
+import sys
+
+EXIT_OK, EXIT_ERROR, EXIT_TERRITORY_FAILURES, EXIT_CANCELLED = 0, 1, 2, 130
+
+def _build_parser():
+    parser = argparse.ArgumentParser(prog="python -m territoryprinter", description="Generate territory map & address-list PDFs without the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    render = commands.add_parser("render", help="Render every territory in the CSV to PDF.")
+    render.add_argument("--csv", required=True, help="Territory CSV (name, number and boundary columns as configured).")
+    render.add_argument("--kml", required=True, help="Address KML.")
+    render.add_argument("--out", required=True, help="Output folder (created if missing).")
+    render.add_argument("--workers", type=int, default=None, help="Render processes (default: RENDER_WORKER_PROCESSES).")
+    _add_input_arguments(render)
+    render.add_argument("--no-prefetch", action="store_true", help="Skip the batch tile prefetch stage.")
+    render.add_argument("--prefetch-rate", type=float, default=None, help="Prefetch requests per second across connections, 0 for no limit (default: BASEMAP_PREFETCH_MAX_REQUESTS_PER_SECOND).")
+    render.add_argument("--force-all", action="store_true", help="Re-render every territory, ignoring the render manifest of unchanged ones.")
+    render.add_argument("--booklet", action="store_true", help="Also write all territories into one PDF (BOOKLET_FILENAME) with a contents page and bookmarks.")
+    render.add_argument("--quiet", action="store_true", help="Omit 'log' events; progress, territory and summary events are still written.")
+
+    serve = commands.add_parser("serve", help="Keep the inputs loaded and render single territories over a local HTTP API.")
+    serve.add_argument("--csv", required=True, help="Territory CSV; reloaded when it changes.")
+    serve.add_argument("--kml", required=True, help="Address KML; reloaded when it changes.")
+    serve.add_argument("--out", required=True, help="Output folder (created if missing).")
+    serve.add_argument("--host", default=None, help="Address to listen on (default: SERVICE_HOST).")
+    serve.add_argument("--port", type=int, default=None, help="Port to listen on (default: SERVICE_PORT).")
+    serve.add_argument("--workers", type=int, default=None, help="Render processes kept warm; 1 renders on a thread in the service process (default: RENDER_WORKER_PROCESSES).")
+    _add_input_arguments(serve)
+    serve.add_argument("--quiet", action="store_true", help="Omit 'log' events.")
+
+    clear = commands.add_parser("clear-cache", help="Delete the parsed-address cache in an output folder.")
+    clear.add_argument("--out", required=True, help="Output folder whose address cache should be cleared.")
+    return parser
+
+def _add_input_arguments(command):
+    # Basemap and address options shared by render and serve.
+    command.add_argument("--tile-url", default=None, help="XYZ tile URL template such as http://localhost:8080/{z}/{x}/{y}.png (default: BASEMAP_PROVIDER).")
+    command.add_argument("--tile-cache", default=None, help="Basemap tile cache folder (default: BASEMAP_TILE_CACHE_FOLDER).")
+    command.add_argument("--no-tile-cache", action="store_true", help="Do not read or write the basemap tile cache.")
+    command.add_argument("--offline-tiles", default=None, help="Read basemap tiles only from this .mbtiles file or {z}/{x}/{y} folder.")
+    command.add_argument("--basemap-mosaic", action="store_true", help="Stitch all tiles once into a reusable mosaic in the output folder and read each map from it.")
+    command.add_argument("--zoom-policy", choices=["adaptive", "fixed"], default=None, help="Basemap zoom per territory from its extent, or always BASEMAP_ZOOM (default: BASEMAP_ZOOM_POLICY).")
+    command.add_argument("--max-tiles", type=int, default=None, help="Tile budget per territory, 0 for none (default: BASEMAP_MAX_TILES_PER_TERRITORY).")
+    command.add_argument("--no-address-cache", action="store_true", help="Always parse the KML instead of using the parsed-address cache.")
+
+def _write_event(event, **fields):
+    sys.stdout.write(json.dumps({'event': event, **fields}, default=str) + "\n"); sys.stdout.flush()
+
+def _apply_overrides(args, config):
+    if args.tile_url:
+        from xyzservices import TileProvider
+        config.BASEMAP_PROVIDER = TileProvider(name="Custom", url=args.tile_url, attribution="")
+    if args.tile_cache: config.BASEMAP_TILE_CACHE_FOLDER = args.tile_cache
+    if args.no_tile_cache: config.BASEMAP_TILE_CACHE_FOLDER = None
+    if args.offline_tiles: config.BASEMAP_OFFLINE_SOURCE = args.offline_tiles
+    if getattr(args, 'no_prefetch', False): config.BASEMAP_PREFETCH_ENABLED = False # render only
+    if getattr(args, 'prefetch_rate', None) is not None: config.BASEMAP_PREFETCH_MAX_REQUESTS_PER_SECOND = args.prefetch_rate
+    if args.basemap_mosaic: config.BASEMAP_MOSAIC_ENABLED = True
+    if args.zoom_policy: config.BASEMAP_ZOOM_POLICY = args.zoom_policy
+    if args.max_tiles is not None: config.BASEMAP_MAX_TILES_PER_TERRITORY = args.max_tiles
+    if args.no_address_cache: config.ADDRESS_CACHE_ENABLED = False
+
+def _run_render(args):
+    for path, label in ((args.csv, "CSV"), (args.kml, "KML")):
+        if not os.path.exists(path): _write_event('finished', status='error', message=f"Error: {label} file not found: {path}"); return EXIT_ERROR
+    from territoryprinter import config
+    from territoryprinter.engine import RenderPipeline
+    _apply_overrides(args, config)
+    os.makedirs(args.out, exist_ok=True)
+    pipeline = RenderPipeline(
+        args.csv, args.kml, args.out, render_workers=args.workers if args.workers else config.RENDER_WORKER_PROCESSES, force_all=args.force_all, booklet=True if args.booklet else None,
+        on_log=None if args.quiet else (lambda message: _write_event('log', message=message)),
+        on_progress=lambda current, total, message: _write_event('progress', current=current, total=total, message=message),
+        on_kml_loaded=lambda success, message: _write_event('kml_loaded', success=success, message=message),
+        on_territory_done=lambda result: _write_event('territory', **result),
+        on_eta=lambda seconds: _write_event('eta', seconds=round(seconds, 1)),
+        on_finished=lambda message: _write_event('finished', message=message))
+
+    def request_stop(signum, frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler) # A second Ctrl+C aborts immediately
+        pipeline.stop()
+    signal.signal(signal.SIGINT, request_stop)
+    summary = pipeline.run()
+    _write_event('summary', **summary)
+    if summary['status'] == 'cancelled': return EXIT_CANCELLED
+    if summary['status'] != 'complete': return EXIT_ERROR
+    return EXIT_TERRITORY_FAILURES if summary['failed'] else EXIT_OK
+
+def _run_serve(args):
+    for path, label in ((args.csv, "CSV"), (args.kml, "KML")):
+        if not os.path.exists(path): _write_event('finished', status='error', message=f"Error: {label} file not found: {path}"); return EXIT_ERROR
+    from territoryprinter import config
+    from territoryprinter.service import RenderService, serve
+    _apply_overrides(args, config)
+    os.makedirs(args.out, exist_ok=True)
+    service = RenderService(args.csv, args.kml, args.out, render_workers=args.workers if args.workers else config.RENDER_WORKER_PROCESSES,
+                            log_emitter=None if args.quiet else (lambda message: _write_event('log', message=message)))
+    for signum in (signal.SIGINT, signal.SIGTERM): signal.signal(signum, signal.default_int_handler) # serve() stops cleanly on KeyboardInterrupt
+    try: serve(service, args.host, args.port)
+    except Exception as serve_err: _write_event('finished', status='error', message=f"Error: {serve_err}"); return EXIT_ERROR
+    _write_event('summary', status='stopped', **service.counts)
+    return EXIT_OK
+
+def _run_clear_cache(args):
+    from territoryprinter.addresses import invalidate_address_cache
+    removed = invalidate_address_cache(args.out, lambda message: _write_event('log', message=message))
+    _write_event('summary', status='complete', removed_files=removed)
+    return EXIT_OK
+
+def main(argv=None):
+    args = _build_parser().parse_args(argv)
+    if args.command == "render": return _run_render(args)
+    if args.command == "serve": return _run_serve(args)
+    return _run_clear_cache(args)
@@ -0,0 +1,82 @@
+# Settings shared by the GUI, the command line and the render processes. Only light imports here so
+# that `python -m territoryprinter --help` and the GUI window come up without loading the heavy stack.
+import os
+from xyzservices import providers as xyz_providers
+from reportlab.lib.units import inch
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_LEFT, TA_CENTER
+
+# --- Configuration ---
+TERRITORY_NAME_INDEX = 1
+TERRITORY_NUMBER_INDEX = 3
+BOUNDARY_COLUMN_INDEX = 11
+OUTPUT_FOLDER = "Generated_Maps_ReportLab_PDF_Corrected_GUI" # New name
+MAP_IMAGE_DPI = 200
+FIGURE_WIDTH_INCHES = 7.5
+FIGURE_MAP_HEIGHT_INCHES = 6.0
+MAP_IMAGE_EMBED_FORMAT = 'lossless' # How the map is embedded in the PDF: 'lossless', 'jpeg' (smallest) or 'indexed' (palette-reduced colours)
+MAP_IMAGE_JPEG_QUALITY = 85
+MAP_IMAGE_INDEXED_COLORS = 256
+BASEMAP_PROVIDER = xyz_providers.OpenStreetMap.Mapnik # Same provider objects contextily exposes as ctx.providers
+BASEMAP_ZOOM = 18 # The zoom under the 'fixed' policy and the highest one 'adaptive' picks
+BASEMAP_ZOOM_POLICY = 'adaptive' # 'adaptive': lowest zoom meeting BASEMAP_TARGET_PIXELS_PER_INCH for the territory's extent; 'fixed': always BASEMAP_ZOOM
+BASEMAP_MIN_ZOOM = 12
+BASEMAP_TARGET_PIXELS_PER_INCH = None # Tile pixels per inch of the map figure; None means MAP_IMAGE_DPI (the basemap is then never upsampled)
+BASEMAP_MAX_TILES_PER_TERRITORY = 100 # A territory needing more tiles is zoomed out until it fits; 0 disables the cap
+BASEMAP_ZOOM_COLUMN_NAME = "Zoom" # Optional CSV column (by header) with a per-territory zoom that overrides the policy
+BASEMAP_TILE_CACHE_FOLDER = os.path.join(os.path.expanduser("~"), ".territoryprinter", "tile_cache") # Persistent provider/z/x/y tile store; None disables it
+BASEMAP_TILE_CACHE_MAX_MB = 2048 # Least-recently-used tiles are evicted beyond this size
+BASEMAP_OFFLINE_SOURCE = None # Path to an .mbtiles file or a {z}/{x}/{y}.png folder; when set, tiles are never downloaded
+BASEMAP_TILE_TIMEOUT_SECONDS = 30
+BASEMAP_TILE_MAX_RETRIES = 3
+BASEMAP_USER_AGENT = "TerritoryPrinter map generator"
+BASEMAP_PREFETCH_ENABLED = True # Download every territory's missing tiles into the cache before rendering
+BASEMAP_PREFETCH_CONNECTIONS = 4 # Concurrent tile downloads during prefetch
+BASEMAP_PREFETCH_MAX_REQUESTS_PER_SECOND = 8 # Across all prefetch connections; 0 disables the limit
+BASEMAP_MOSAIC_ENABLED = False # Stitch all territories' tiles once into a memory-mapped raster and read each map as a window of it
+BASEMAP_MOSAIC_FOLDER_NAME = "_basemap_mosaic" # In the output folder, one layer per zoom; reused while the tile source and territory extent are unchanged
+BASEMAP_MOSAIC_MAX_MB = 4096 # Larger mosaics are not built; territories then stitch their own tiles
+BOUNDARY_STYLE = {'edgecolor': '#FF0000', 'facecolor': 'none', 'linewidth': 1.5, 'zorder': 4}
+MASK_STYLE = {'facecolor': 'black', 'edgecolor': 'none', 'alpha': 0.4, 'zorder': 3}
+
+# --- ReportLab Paragraph Style Attributes Dictionaries ---
+BASE_NORMAL_STYLE_ATTRS = {'fontSize': 7, 'leading': 9, 'fontName': 'Helvetica'}
+TITLE_RL_STYLE_ATTRS = {'alignment': TA_CENTER, 'fontSize': 16, 'spaceAfter': 0.15*inch,
+                          'fontName': 'Helvetica-Bold', 'keepWithNext': 1}
+STREET_HEADER_RL_STYLE_ATTRS = {'fontName': 'Helvetica-Bold', 'backColor': colors.Color(0.9,0.9,0.9),
+                                 'alignment': TA_LEFT, 'leftIndent': 0}
+ADDRESS_TABLE_MODE = 'auto' # 'paragraph', 'fast' (same look, plain-string cells), 'compact' (multi-column list) or 'auto'
+ADDRESS_TABLE_FAST_THRESHOLD = 300 # 'auto' uses the fast table from this many addresses in a territory
+ADDRESS_COMPACT_COLUMNS = 3
+
+KML_ADDRESS_COMPONENT_TAGS = {
+    'house_number': ["STREET_NUM", "AD_ADDRESS", "AM_ADDRE_1"],
+    'street_prefix': ["STREET_PRE", "AM_DIR_PRE"],
+    'street_name': ["STREET_NAM", "AM_STR_NAM"],
+    'street_type': ["STREET_TYP", "AM_STR_TYP"],
+    'street_suffix': ["STREET_SUF", "AM_DIR_SUF"],
+    'unit_type': ["UNIT_TYPE"],
+    'unit_number': ["UNIT_NUMBE"],
+    'city': ["CITY", "AM_TOWN"],
+    'state': ["STATE", "AM_STATE"],
+    'zip': ["ZIP", "AM_ZIP"]
+}
+TARGET_CRS = "EPSG:3857"
+KML_FILTER_TO_TERRITORY_BBOX = True # Drop addresses outside the bounding box of all CSV territories: while parsing without the address cache, after it with the cache
+ADDRESS_CACHE_ENABLED = True # Keep parsed + projected KML addresses in a Feather file inside the output folder (needs pyarrow)
+ADDRESS_CACHE_FOLDER_NAME = "_address_cache"
+ADDRESS_CACHE_FORMAT_VERSION = 1
+RENDER_WORKER_PROCESSES = 1 # 1 renders in the worker thread; more renders territories in parallel processes
+ASSIGNMENT_REPORT_FILENAME = "_address_assignment_report.csv" # Addresses in no territory or in several
+BOUNDARY_REPORT_FILENAME = "_boundary_error_report.csv" # CSV rows skipped for a missing, unreadable or unusable boundary
+BOOKLET_ENABLED = False # Also write every territory, in CSV order, into one PDF book with a contents page and bookmarks (needs pypdf)
+BOOKLET_FILENAME = "Territory_Booklet.pdf"
+RUN_LOG_FILENAME = "_run_log.txt" # Every log line of the run, in the output folder; None disables it
+GUI_UPDATE_INTERVAL_MS = 100 # The GUI applies queued log lines and the latest progress at this rate
+GUI_LOG_MAX_LINES = 5000 # Lines kept in the GUI log view; older ones are dropped (the run log file has them all)
+SERVICE_HOST = "127.0.0.1" # `python -m territoryprinter serve` listens here; keep it local, the API has no authentication
+SERVICE_PORT = 8770
+SERVICE_RELOAD_POLL_SECONDS = 2.0 # How often the service checks the CSV and KML for changes
+RUN_REPORT_ENABLED = True # Write _run_report.json (per-stage timing percentiles) and _run_report.csv (one row per territory) after each run
+# LOADED_KML_GDF_CACHE # This was for the worker, remove global if not used globally anymore
+
@@ -0,0 +1,276 @@
+# Qt-free pipeline behind both the GUI and the command line. Heavy libraries are imported by the
+# stage that first needs them, so constructing a RenderPipeline (or parsing CLI arguments) is cheap.
+import os
+import time
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from territoryprinter import config
+
+CSV_NA_VALUES = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'n/a', 'nan', 'null']
+
+def _ignore(*args): pass
+
+class RenderPipeline:
+    # Reports through plain callbacks: on_log(message), on_progress(current, total, message),
+    # on_kml_loaded(success, message), on_territory_done(result), on_eta(seconds) and on_finished(message).
+    # run() also returns a summary dict.
+    def __init__(self, csv_path, kml_path, output_folder, render_workers=config.RENDER_WORKER_PROCESSES,
+                 force_all=False, booklet=None, on_log=None, on_progress=None, on_kml_loaded=None, on_territory_done=None, on_eta=None, on_finished=None):
+        self.csv_path = csv_path
+        self.kml_path = kml_path
+        self.output_folder = output_folder
+        self.render_workers = max(1, int(render_workers))
+        self.force_all = force_all # Ignore the render manifest and rebuild every territory
+        self.booklet = config.BOOKLET_ENABLED if booklet is None else booklet
+        self.booklet_writer = None
+        self.on_log = on_log or _ignore; self.on_progress = on_progress or _ignore; self.on_kml_loaded = on_kml_loaded or _ignore
+        self.on_territory_done = on_territory_done or _ignore; self.on_eta = on_eta or _ignore; self.on_finished = on_finished or _ignore
+        self.is_cancelled = False
+        self.log_file = None; self._log_lock = threading.Lock() # stop() logs from the caller's thread
+        self.run_report = None; self.render_total = 0
+        self.summary = {'status': 'not_started', 'territories': 0, 'rendered': 0, 'skipped': 0, 'failed': 0, 'pdf_paths': [], 'booklet_path': None, 'run_report_path': None}
+
+    def _emit_log(self, message):
+        with self._log_lock:
+            if self.log_file is not None: self.log_file.write(message + "\n")
+        self.on_log(message)
+
+    def _open_run_log(self):
+        # The full log of the run, whatever the GUI's bounded log view keeps.
+        if not config.RUN_LOG_FILENAME: return
+        try: self.log_file = open(os.path.join(self.output_folder, config.RUN_LOG_FILENAME), 'w', encoding='utf-8', buffering=1)
+        except OSError as log_err: self.on_log(f"Could not open run log file: {log_err}")
+
+    def _close_run_log(self):
+        with self._log_lock:
+            if self.log_file is not None: self.log_file.close(); self.log_file = None
+
+    def _finish(self, status, message):
+        self.summary['status'] = status; self.summary['message'] = message
+        self._write_run_report(status)
+        if self.log_file is not None: self._emit_log(f"--- {message} ---")
+        self._close_run_log()
+        self.on_finished(message)
+        return self.summary
+
+    def run(self):
+        try:
+            self._open_run_log()
+            self._emit_log("--- Processing Started ---")
+            from territoryprinter.instrumentation import RunReport
+            self.run_report = report = RunReport(self.render_workers)
+            import pandas as pd
+            self._emit_log(f"Loading CSV: {self.csv_path}")
+            with report.stage('csv_load'): df = pd.read_csv(self.csv_path, keep_default_na=True, na_values=CSV_NA_VALUES)
+            total_rows = len(df)
+            self._emit_log(f"Loaded {total_rows} rows from CSV.")
+            max_required_index = max(config.TERRITORY_NAME_INDEX,config.TERRITORY_NUMBER_INDEX,config.BOUNDARY_COLUMN_INDEX)
+            if df.shape[1] <= max_required_index:
+                return self._finish('error', "Error: CSV columns mismatch.")
+
+            from territoryprinter.territories import prepare_territories, assign_addresses_to_territories
+            with report.stage('boundary_parse'):
+                territories_wm = prepare_territories(df, self._emit_log, report_path=os.path.join(self.output_folder, config.BOUNDARY_REPORT_FILENAME))
+            self.summary['territories'] = len(territories_wm)
+            self._emit_log(f"Prepared {len(territories_wm)} territories with valid boundaries.")
+            kml_bbox = None
+            if config.KML_FILTER_TO_TERRITORY_BBOX and not territories_wm.empty:
+                kml_bbox = tuple(territories_wm.geometry.to_crs("EPSG:4326").total_bounds)
+                self._emit_log(f"  Territory bounding box for KML ingest: {tuple(round(float(v), 6) for v in kml_bbox)}")
+
+            from territoryprinter.addresses import address_cache_folder, load_projected_kml_addresses, add_address_display_columns
+            projected_kml_gdf_wm = load_projected_kml_addresses(
+                self.kml_path, config.KML_ADDRESS_COMPONENT_TAGS, address_cache_folder(self.output_folder), self._emit_log, bbox=kml_bbox, timer=report.timer
+            )
+            if self.is_cancelled: return self._finish('cancelled', "Processing cancelled.")
+            if projected_kml_gdf_wm.empty:
+                self.on_kml_loaded(False, "KML data empty or failed to load. House numbers will be missing.")
+            else:
+                self.on_kml_loaded(True, f"KML loaded: {len(projected_kml_gdf_wm)} addresses found.")
+            with report.stage('filter'):
+                projected_kml_gdf_wm = add_address_display_columns(projected_kml_gdf_wm)
+                address_slices = assign_addresses_to_territories(projected_kml_gdf_wm, territories_wm, self._emit_log,
+                                                                 report_path=os.path.join(self.output_folder, config.ASSIGNMENT_REPORT_FILENAME))
+            if self.is_cancelled: return self._finish('cancelled', "Processing cancelled.")
+
+            from territoryprinter.tiles import choose_basemap_zooms
+            with report.stage('basemap_zoom'): choose_basemap_zooms(territories_wm, self._emit_log)
+
+            from territoryprinter.manifest import assign_pdf_filenames, load_manifest, plan_incremental_render
+            from territoryprinter.render import render_config_fingerprint
+            with report.stage('manifest'):
+                assign_pdf_filenames(territories_wm, self._emit_log); self.manifest = load_manifest(self.output_folder, self._emit_log)
+                positions_to_render, self.manifest_entries = plan_incremental_render(
+                    territories_wm, projected_kml_gdf_wm, address_slices, self.output_folder, self.manifest, render_config_fingerprint(), force_all=self.force_all)
+            # Territories left out of this run keep their manifest entry; failed ones drop out so they are retried next time.
+            rendering = set(positions_to_render)
+            self.manifest['territories'] = {pdf_filename: {'hash': entry['hash']} for pdf_filename, entry in self.manifest_entries.items() if entry['position'] not in rendering}
+            self.manifest_filenames = list(territories_wm['pdf_filename']) # Position -> PDF filename, unique per territory
+            self.summary['skipped'] = len(territories_wm) - len(positions_to_render)
+            if self.force_all: self._emit_log(f"Force re-render: rebuilding all {len(positions_to_render)} territories.")
+            else: self._emit_log(f"Incremental render: {len(positions_to_render)} to rebuild, {self.summary['skipped']} unchanged and skipped.")
+            territories_to_render = territories_wm.iloc[positions_to_render]
+            self._start_booklet(territories_wm, rendering)
+
+            from territoryprinter.tiles import basemap_tile_config, empty_tile_stats, format_tile_stats
+            tile_config = basemap_tile_config(); self.tile_stats_total = empty_tile_stats()
+            if tile_config['offline_source']: self._emit_log(f"Basemap tiles: offline source {tile_config['offline_source']}")
+            elif tile_config['cache_folder']: self._emit_log(f"Basemap tiles: cache {tile_config['cache_folder']} (max {config.BASEMAP_TILE_CACHE_MAX_MB} MB)")
+            if config.BASEMAP_PREFETCH_ENABLED and not territories_to_render.empty:
+                with report.stage('prefetch'): self._prefetch_basemap_tiles(territories_to_render, tile_config)
+            if self.is_cancelled: return self._finish('cancelled', "Processing cancelled by user.")
+            if config.BASEMAP_MOSAIC_ENABLED and not territories_to_render.empty:
+                with report.stage('mosaic'): tile_config['mosaic'] = self._prepare_basemap_mosaic(territories_wm, tile_config)
+            if self.is_cancelled: return self._finish('cancelled', "Processing cancelled by user.")
+
+            from territoryprinter.render import build_render_task
+            render_tasks = (build_render_task(territories_wm, position, projected_kml_gdf_wm, address_slices, self.output_folder, tile_config)
+                            for position in positions_to_render)
+            self.render_total = len(positions_to_render); report.start_render()
+            with report.stage('render'):
+                if self.render_workers > 1 and len(positions_to_render) > 1: self._render_in_processes(render_tasks, len(positions_to_render))
+                else: self._render_in_thread(render_tasks, total_rows)
+            self._emit_log(f"\nBasemap tile totals: {format_tile_stats(self.tile_stats_total)}")
+
+            if self.is_cancelled: self._abort_booklet(); return self._finish('cancelled', "Processing cancelled by user.")
+            if self.booklet_writer is not None:
+                with report.stage('booklet'): self._finish_booklet()
+            self.on_progress(total_rows, total_rows, "All territories processed.")
+            self._emit_log(f"Territories rebuilt: {self.summary['rendered']}, skipped (unchanged): {self.summary['skipped']}, failed: {self.summary['failed']}.")
+            return self._finish('complete', f"Processing complete! {self.summary['rendered']} rebuilt, {self.summary['skipped']} skipped.")
+        except Exception as e:
+            self._abort_booklet()
+            self._emit_log(f"--- Critical Error in Worker Thread ---\nError: {e}\n{traceback.format_exc()}")
+            return self._finish('error', f"Error: {e}")
+
+    def _prefetch_basemap_tiles(self, territories_wm, tile_config):
+        from territoryprinter.tiles import basemap_tiles_for_territories, get_basemap_tile_source
+        if tile_config['offline_source'] or not tile_config['cache_folder']:
+            self._emit_log("Basemap prefetch skipped (offline source in use or tile cache disabled)."); return
+        tiles, requested = basemap_tiles_for_territories(territories_wm.geometry, territories_wm['basemap_zoom'])
+        zooms = sorted(set(territories_wm['basemap_zoom'].tolist()))
+        self._emit_log(f"Prefetching basemap tiles: {len(tiles)} unique tiles at zoom {', '.join(map(str, zooms))} ({requested} across {len(territories_wm)} territories)...")
+        tile_source = get_basemap_tile_source(tile_config); started = time.time()
+        on_progress = lambda done, total: self.on_progress(done, max(total, 1), f"Prefetching tiles {done}/{total}")
+        already_cached, downloaded, failed = tile_source.prefetch(tiles, config.BASEMAP_PREFETCH_CONNECTIONS, config.BASEMAP_PREFETCH_MAX_REQUESTS_PER_SECOND,
+                                                                  is_cancelled=lambda: self.is_cancelled, on_progress=on_progress)
+        self._emit_log(f"  - {already_cached} already cached, {downloaded} downloaded, {failed} failed in {time.time() - started:.1f}s.")
+        if failed: self._emit_log("  - Failed tiles will be retried when their territory is rendered.")
+
+    def _prepare_basemap_mosaic(self, territories_wm, tile_config):
+        # Covers every territory, not just this run's, so later incremental runs reuse the same mosaic.
+        from territoryprinter.tiles import get_basemap_tile_source
+        from territoryprinter.mosaic import mosaic_folder, prepare_basemap_mosaic
+        self._emit_log(f"Preparing the basemap mosaic (zoom {', '.join(map(str, sorted(set(territories_wm['basemap_zoom'].tolist()), reverse=True)))})...")
+        on_progress = lambda done, total: self.on_progress(done, max(total, 1), f"Stitching basemap mosaic {done}/{total}")
+        return prepare_basemap_mosaic(territories_wm.geometry, territories_wm['basemap_zoom'], get_basemap_tile_source(tile_config), mosaic_folder(self.output_folder),
+                                      self._emit_log, is_cancelled=lambda: self.is_cancelled, on_progress=on_progress)
+
+    def _collect_render_result(self, result):
+        from territoryprinter.tiles import TILE_STAT_KEYS
+        for key in TILE_STAT_KEYS: self.tile_stats_total[key] += result['tile_stats'][key]
+        if result['success']:
+            self.summary['rendered'] += 1; self.summary['pdf_paths'].append(result['pdf_path'])
+            self._record_in_manifest(result['position'])
+        elif not result.get('cancelled'): self.summary['failed'] += 1
+        self._add_to_booklet(result['position'], result['pdf_path'] if result['success'] else None)
+        self.run_report.add_territory(result)
+        eta_seconds = self.run_report.eta_seconds(len(self.run_report.territories), self.render_total)
+        if eta_seconds is not None: self.on_eta(eta_seconds)
+        self.on_territory_done(result)
+
+    def _write_run_report(self, status):
+        # _run_report.json (per-stage percentiles) and _run_report.csv (one row per territory) in the output folder.
+        if self.run_report is None or not config.RUN_REPORT_ENABLED: return
+        from territoryprinter.instrumentation import format_stage_summary
+        try: json_path, csv_path, report_summary = self.run_report.write(self.output_folder, status)
+        except OSError as report_err: self._emit_log(f"Could not write run report: {report_err}"); return
+        self.summary['run_report_path'] = json_path
+        self._emit_log(f"Stage timings (per territory, then whole run; peak RSS {report_summary['peak_rss_mb']} MB):")
+        for line in format_stage_summary(report_summary): self._emit_log(line)
+        self._emit_log(f"Run report saved: {json_path}, {csv_path}")
+
+    def _record_in_manifest(self, position):
+        # Saved after every PDF so a cancelled or crashed run still skips what it finished.
+        from territoryprinter.manifest import save_manifest
+        pdf_filename = self.manifest_filenames[position]
+        self.manifest['territories'][pdf_filename] = {'hash': self.manifest_entries[pdf_filename]['hash']}
+        try: save_manifest(self.output_folder, self.manifest)
+        except OSError as manifest_err: self._emit_log(f"  Could not write render manifest: {manifest_err}")
+
+    # --- Combined Booklet (assembled in CSV order while territories finish) ---
+    def _start_booklet(self, territories_wm, rendering):
+        if not self.booklet: return
+        from territoryprinter.booklet import BookletWriter, booklet_available
+        if not booklet_available(): self._emit_log("Booklet skipped: pypdf is not installed."); return
+        self.booklet_writer = BookletWriter(os.path.join(self.output_folder, config.BOOKLET_FILENAME))
+        self.booklet_titles = [f"{name} - {number}" for name, number in zip(territories_wm['name'], territories_wm['number'])]
+        # Skipped territories are ready at once; the others become ready as their result arrives.
+        self.booklet_ready = {position: os.path.join(self.output_folder, self.manifest_filenames[position])
+                              for position in range(len(territories_wm)) if position not in rendering}
+        self.booklet_next = 0; self._flush_booklet()
+
+    def _add_to_booklet(self, position, pdf_path):
+        if self.booklet_writer is None: return
+        self.booklet_ready[position] = pdf_path; self._flush_booklet()
+
+    def _flush_booklet(self):
+        # Territory PDFs are appended strictly in CSV order; out-of-order parallel results wait here.
+        while self.booklet_next in self.booklet_ready:
+            pdf_path = self.booklet_ready.pop(self.booklet_next); title = self.booklet_titles[self.booklet_next]; self.booklet_next += 1
+            if pdf_path is None: self._emit_log(f"  Booklet: '{title}' left out (render failed)."); continue
+            try: self.booklet_writer.add_pdf(title, pdf_path)
+            except Exception as booklet_err: self._emit_log(f"  Booklet: could not add '{title}': {booklet_err}")
+
+    def _finish_booklet(self):
+        if self.booklet_writer is None: return
+        for position in range(self.booklet_next, len(self.booklet_titles)): self.booklet_ready.setdefault(position, None) # Lost to a crashed render process
+        self._flush_booklet()
+        if not self.booklet_writer.entries: self._emit_log("Booklet skipped: no territory PDFs."); self._abort_booklet(); return
+        self.booklet_writer.close(); self.summary['booklet_path'] = self.booklet_writer.path
+        self._emit_log(f"Booklet saved: {self.booklet_writer.path} ({len(self.booklet_writer.entries)} territories)")
+        self.booklet_writer = None
+
+    def _abort_booklet(self):
+        if self.booklet_writer is None: return
+        self.booklet_writer.abort(); self.booklet_writer = None
+
+    def _render_in_thread(self, render_tasks, total_rows):
+        from territoryprinter.render import run_render_task
+        for task in render_tasks:
+            if self.is_cancelled: break
+            index = task['row_index']
+            self.on_progress(index, total_rows, f"Territory {index + 1}/{total_rows}")
+            self._collect_render_result(run_render_task(task, self._emit_log, lambda: self.is_cancelled))
+
+    def _render_in_processes(self, render_tasks, n_tasks):
+        from territoryprinter.render import _render_territory_in_process, _init_render_process
+        n_workers = min(self.render_workers, n_tasks); completed = 0
+        self._emit_log(f"\nRendering {n_tasks} territories in {n_workers} worker processes...")
+        self.on_progress(0, n_tasks, f"Rendering {n_tasks} territories in parallel...")
+        mp_context = multiprocessing.get_context('spawn'); cancel_event = mp_context.Event()
+        executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=mp_context, initializer=_init_render_process, initargs=(cancel_event,))
+        try:
+            pending = {executor.submit(_render_territory_in_process, task) for task in render_tasks}
+            while pending:
+                done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                for future in done:
+                    completed += 1
+                    try:
+                        result = future.result()
+                        for line in result.pop('log_lines'): self._emit_log(line)
+                        self._collect_render_result(result)
+                    except Exception as worker_err: self._emit_log(f"  --- Render process failed: {worker_err} ---"); self.summary['failed'] += 1
+                    self.on_progress(completed, n_tasks, f"Territory {completed}/{n_tasks} rendered")
+                if self.is_cancelled and pending:
+                    self._emit_log(f"  Cancelling {len(pending)} queued territories; running ones stop at their next checkpoint...")
+                    cancel_event.set()
+                    for future in pending: future.cancel()
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stop(self): self.is_cancelled = True; self._emit_log("Cancellation requested...")
@@ -0,0 +1,129 @@
+# Run instrumentation: wall time, CPU time and peak RSS per pipeline stage and per territory stage, plus
+# per-territory counts, written as a run report (JSON summary with percentiles + one CSV row per territory).
+import os
+import sys
+import csv
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+# --- Optional: peak RSS (resource on POSIX, psutil elsewhere) ---
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+RUN_REPORT_JSON_FILENAME = "_run_report.json"
+RUN_REPORT_CSV_FILENAME = "_run_report.csv"
+TERRITORY_STAGES = ('basemap', 'mask', 'savefig', 'table_build', 'pdf_build')
+TERRITORY_COUNTS = ('addresses', 'tiles', 'pages')
+REPORT_PERCENTILES = (50, 90, 95, 99)
+
+def peak_rss_mb():
+    # High-water mark of this process's resident memory in MB, or None where it cannot be read.
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # KB on Linux, bytes on macOS
+        return round(peak / ((1 << 20) if sys.platform == 'darwin' else 1024), 1)
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, 'peak_wset', memory.rss) / (1 << 20), 1)
+    return None
+
+def format_duration(seconds):
+    seconds = int(round(max(0, seconds))); hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60}:{rest % 60:02d}"
+
+class StageTimer:
+    # Wall and CPU seconds per named stage (a repeated stage accumulates) and the peak RSS when it last ended.
+    # Territory timers pass time.thread_time so a render thread is not charged for the GUI thread's CPU.
+    def __init__(self, cpu_clock=time.process_time):
+        self.cpu_clock = cpu_clock; self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        wall_started, cpu_started = time.perf_counter(), self.cpu_clock()
+        try: yield
+        finally:
+            record = self.stages.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': None})
+            record['wall_s'] += time.perf_counter() - wall_started; record['cpu_s'] += self.cpu_clock() - cpu_started
+            record['peak_rss_mb'] = peak_rss_mb()
+
+def timed(timer, name):
+    # Stage context for an optional timer; without one nothing is recorded.
+    return nullcontext() if timer is None else timer.stage(name)
+
+def _percentiles(values):
+    # Linear interpolation between closest ranks (numpy's default), plus mean, max and total.
+    values = sorted(values)
+    if not values: return None
+    summary = {}
+    for percentile in REPORT_PERCENTILES:
+        rank = (len(values) - 1) * percentile / 100; lower = int(rank); upper = min(lower + 1, len(values) - 1)
+        summary[f"p{percentile}"] = round(values[lower] + (values[upper] - values[lower]) * (rank - lower), 4)
+    summary.update(mean=round(sum(values) / len(values), 4), max=round(values[-1], 4), total=round(sum(values), 4), n=len(values))
+    return summary
+
+class RunReport:
+    # Collects the pipeline's own stages and every territory result of one run. Render-process CPU shows up in
+    # the territory stages; the run-level 'render' stage only counts the CPU of the process driving the pool.
+    def __init__(self, render_workers):
+        self.render_workers = render_workers; self.timer = StageTimer()
+        self.started = time.time(); self.render_started = None; self.territories = []
+
+    def stage(self, name): return self.timer.stage(name)
+
+    def start_render(self): self.render_started = time.perf_counter()
+
+    def eta_seconds(self, completed, total):
+        # Remaining territories at the throughput measured so far in this run (territories per wall second).
+        if not completed or self.render_started is None: return None
+        return (total - completed) * (time.perf_counter() - self.render_started) / completed
+
+    def add_territory(self, result):
+        self.territories.append({'position': result['position'], 'row_index': result['row_index'], 'name': result.get('name'), 'number': result.get('number'),
+                                 'success': result['success'], 'wall_s': result.get('wall_s'), 'stages': result.get('stages', {}),
+                                 'counts': result.get('counts', {}), 'peak_rss_mb': result.get('peak_rss_mb')})
+
+    def summary(self, status):
+        succeeded = [territory for territory in self.territories if territory['success']]
+        peaks = [peak for peak in [peak_rss_mb()] + [territory['peak_rss_mb'] for territory in self.territories] if peak is not None]
+        return {'status': status, 'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'elapsed_s': round(time.time() - self.started, 3), 'render_workers': self.render_workers,
+                'territories': len(self.territories), 'succeeded': len(succeeded), 'peak_rss_mb': max(peaks) if peaks else None,
+                'run_stages': {name: {key: round(value, 4) if isinstance(value, float) else value for key, value in record.items()}
+                               for name, record in self.timer.stages.items()},
+                'territory_wall_s': _percentiles([territory['wall_s'] for territory in succeeded]),
+                'territory_stages': {stage: {'wall_s': _percentiles([territory['stages'][stage]['wall_s'] for territory in succeeded if stage in territory['stages']]),
+                                             'cpu_s': _percentiles([territory['stages'][stage]['cpu_s'] for territory in succeeded if stage in territory['stages']])}
+                                     for stage in TERRITORY_STAGES},
+                'territory_counts': {count: _percentiles([territory['counts'][count] for territory in succeeded if count in territory['counts']])
+                                     for count in TERRITORY_COUNTS}}
+
+    def write(self, output_folder, status):
+        # Returns (json_path, csv_path, summary).
+        summary = self.summary(status)
+        json_path = os.path.join(output_folder, RUN_REPORT_JSON_FILENAME); csv_path = os.path.join(output_folder, RUN_REPORT_CSV_FILENAME)
+        with open(json_path, 'w', encoding='utf-8') as f: json.dump(summary, f, indent=1)
+        stage_columns = [f"{stage}_{measure}" for stage in TERRITORY_STAGES for measure in ('wall_s', 'cpu_s')]
+        with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['position', 'row_index', 'name', 'number', 'success', 'wall_s'] + stage_columns + list(TERRITORY_COUNTS) + ['peak_rss_mb'])
+            for territory in self.territories:
+                stages = territory['stages']
+                writer.writerow([territory['position'], territory['row_index'], territory['name'], territory['number'], territory['success'],
+                                 None if territory['wall_s'] is None else round(territory['wall_s'], 4)]
+                                + [round(stages[stage][measure], 4) if stage in stages else None for stage in TERRITORY_STAGES for measure in ('wall_s', 'cpu_s')]
+                                + [territory['counts'].get(count) for count in TERRITORY_COUNTS] + [territory['peak_rss_mb']])
+        return json_path, csv_path, summary
+
+def format_stage_summary(summary):
+    # Log lines: median/p95 wall seconds per territory stage, slowest first.
+    stages = [(stage, timing['wall_s']) for stage, timing in summary['territory_stages'].items() if timing['wall_s']]
+    lines = [f"  {stage:<14} p50 {wall['p50']:.3f}s  p95 {wall['p95']:.3f}s  total {wall['total']:.1f}s"
+             for stage, wall in sorted(stages, key=lambda item: -item[1]['total'])]
+    lines += [f"  {stage:<14} {record['wall_s']:.3f}s wall, {record['cpu_s']:.3f}s CPU" for stage, record in summary['run_stages'].items()]
+    return lines
@@ -0,0 +1,75 @@
+# Render manifest for incremental regeneration: one input hash per territory PDF in the output folder.
+# A territory whose hash is unchanged and whose PDF still exists is skipped on the next run.
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+MANIFEST_FILENAME = "_render_manifest.json"
+MANIFEST_FORMAT_VERSION = 1
+MANIFEST_ADDRESS_COLUMNS = ['full_street_display', 'address_display', 'unit_display', 'locality_display']
+
+def manifest_path(output_folder):
+    return os.path.join(output_folder, MANIFEST_FILENAME)
+
+def load_manifest(output_folder, log_emitter=None):
+    try:
+        with open(manifest_path(output_folder), 'r', encoding='utf-8') as f: manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_FORMAT_VERSION: return manifest
+        if log_emitter: log_emitter("  Render manifest has an older format; every territory will be rebuilt.")
+    except FileNotFoundError: pass
+    except (ValueError, OSError) as manifest_err:
+        if log_emitter: log_emitter(f"  Render manifest unreadable ({manifest_err}); every territory will be rebuilt.")
+    return {'version': MANIFEST_FORMAT_VERSION, 'territories': {}}
+
+def save_manifest(output_folder, manifest):
+    path = manifest_path(output_folder); temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f: json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+def address_row_hashes(addresses):
+    # One uint64 per address over its displayed text; territories hash the sorted set of these.
+    if addresses.empty: return np.empty(0, dtype=np.uint64)
+    return pd.util.hash_pandas_object(addresses[MANIFEST_ADDRESS_COLUMNS], index=False).to_numpy()
+
+def territory_input_hash(boundary, name, number, territory_address_hashes, render_fingerprint_json, basemap_zoom=None):
+    digest = hashlib.sha256()
+    for part in (boundary, name, number, render_fingerprint_json, basemap_zoom): digest.update(str(part).encode('utf-8')); digest.update(b'\0')
+    digest.update(np.sort(territory_address_hashes).tobytes())
+    return digest.hexdigest()
+
+def assign_pdf_filenames(territories_wm, log_emitter=None):
+    # Adds the pdf_filename column. Rows whose name and number sanitize to the same filename (case-insensitively, for
+    # Windows) get their CSV row appended after the first, so no PDF or manifest entry replaces another.
+    from territoryprinter.render import territory_pdf_filename
+    pdf_filenames = []; taken = set(); renamed = []
+    for name, number, row_index in zip(territories_wm['name'], territories_wm['number'], territories_wm['row_index']):
+        pdf_filename = territory_pdf_filename(name, number, int(row_index))
+        if pdf_filename.lower() in taken:
+            renamed.append((int(row_index), pdf_filename)); pdf_filename = f"{pdf_filename[:-len('.pdf')]}_row{int(row_index)}.pdf"
+            while pdf_filename.lower() in taken: pdf_filename = f"{pdf_filename[:-len('.pdf')]}_row{int(row_index)}.pdf"
+        taken.add(pdf_filename.lower()); pdf_filenames.append(pdf_filename)
+    territories_wm['pdf_filename'] = pdf_filenames
+    if renamed and log_emitter:
+        log_emitter(f"  {len(renamed)} territories share a PDF filename with an earlier row; their CSV row is appended to the filename:")
+        for row_index, pdf_filename in renamed[:20]: log_emitter(f"    - Row {row_index}: {pdf_filename}")
+        if len(renamed) > 20: log_emitter(f"    ... and {len(renamed) - 20} more")
+    return territories_wm
+
+def plan_incremental_render(territories_wm, projected_kml_gdf_wm, address_slices, output_folder, manifest, render_fingerprint, force_all=False):
+    # Returns (positions to render, {pdf filename: manifest entry} for every current territory).
+    if 'pdf_filename' not in territories_wm: assign_pdf_filenames(territories_wm)
+    fingerprint_json = json.dumps(render_fingerprint, sort_keys=True, default=str)
+    row_hashes = address_row_hashes(projected_kml_gdf_wm)
+    previous = manifest.get('territories', {}); positions_to_render = []; entries = {}
+    for position in range(len(territories_wm)):
+        name = territories_wm['name'].iloc[position]; number = territories_wm['number'].iloc[position]
+        pdf_filename = territories_wm['pdf_filename'].iloc[position]
+        input_hash = territory_input_hash(territories_wm['boundary'].iloc[position], name, number,
+                                          row_hashes[address_slices[position]] if len(row_hashes) else row_hashes, fingerprint_json,
+                                          int(territories_wm['basemap_zoom'].iloc[position]) if 'basemap_zoom' in territories_wm else None)
+        entries[pdf_filename] = {'hash': input_hash, 'position': position}
+        unchanged = previous.get(pdf_filename, {}).get('hash') == input_hash and os.path.exists(os.path.join(output_folder, pdf_filename))
+        if force_all or not unchanged: positions_to_render.append(position)
+    return positions_to_render, entries
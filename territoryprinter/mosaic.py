@@ -0,0 +1,142 @@
+# Pre-stitched basemap mosaic: every tile the territories need is decoded once into one RGBA raster per zoom
+# level in use (a memory-mapped .npy in the output folder) covering their combined tile range. Each territory
+# then takes its map as a window of its zoom's array, with no tile decoding or stitching. A layer is kept for
+# later runs while the tile source and its tile range stay the same; tiles new territories need are added to it.
+import os
+import io
+import json
+import time
+import shutil
+import numpy as np
+import mercantile as mt
+from PIL import Image as PILImage
+
+from territoryprinter import config
+from territoryprinter.tiles import basemap_tiles_for_territories, tiles_for_bounds
+
+MOSAIC_FORMAT_VERSION = 2
+MOSAIC_IMAGE_FILENAME = "mosaic.npy"
+MOSAIC_FILLED_FILENAME = "filled.npy" # One bool per tile: decoded into the mosaic
+MOSAIC_META_FILENAME = "mosaic.json"
+_open_mosaics = {} # mosaic folder -> BasemapMosaicSource, at most one generation per layer per process
+
+def mosaic_folder(output_folder):
+    # Holds one z<zoom> folder per layer.
+    return os.path.join(output_folder, config.BASEMAP_MOSAIC_FOLDER_NAME)
+
+def _mosaic_key(tile_source, zoom, x_range, y_range):
+    provider = tile_source.provider
+    return {'version': MOSAIC_FORMAT_VERSION, 'provider': [provider.get('name'), provider.get('url')], 'offline_source': tile_source.offline_source,
+            'zoom': zoom, 'x_range': list(x_range), 'y_range': list(y_range)}
+
+def _read_meta(folder):
+    try:
+        with open(os.path.join(folder, MOSAIC_META_FILENAME), 'r', encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError): return None
+
+def _write_meta(folder, meta):
+    path = os.path.join(folder, MOSAIC_META_FILENAME)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f: json.dump(meta, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def _decode_tile(data):
+    with PILImage.open(io.BytesIO(data)) as tile_image: return np.asarray(tile_image.convert('RGBA')) # As BasemapTileSource.mosaic decodes
+
+def prepare_basemap_mosaic(territory_polygons_wm, zooms, tile_source, folder, log_emitter, is_cancelled=None, on_progress=None):
+    # One layer per zoom in zooms (one per territory), built or topped up; returns the descriptor render tasks
+    # carry, or None when there is no layer. Layers that would take the total past BASEMAP_MOSAIC_MAX_MB are
+    # not built and their territories render from tiles as before.
+    zooms = np.asarray(zooms, dtype=int); layers = {}; budget_mb = config.BASEMAP_MOSAIC_MAX_MB
+    os.makedirs(folder, exist_ok=True)
+    for stale in set(os.listdir(folder)) - {f"z{zoom}" for zoom in zooms.tolist()}: # Layers for zooms no territory uses any more
+        _close_mosaic(folder); stale = os.path.join(folder, stale)
+        if os.path.isdir(stale): shutil.rmtree(stale, ignore_errors=True)
+        else: os.remove(stale)
+    for zoom in sorted(set(zooms.tolist()), reverse=True):
+        if is_cancelled and is_cancelled(): break
+        polygons = [polygon for polygon, polygon_zoom in zip(territory_polygons_wm, zooms) if polygon_zoom == zoom]
+        layer = _prepare_layer(polygons, tile_source, zoom, os.path.join(folder, f"z{zoom}"), budget_mb, log_emitter, is_cancelled, on_progress)
+        if layer is not None: layers[zoom] = layer; budget_mb -= layer['size_mb']
+    return {'folder': folder, 'layers': layers} if layers else None
+
+def _prepare_layer(territory_polygons_wm, tile_source, zoom, folder, budget_mb, log_emitter, is_cancelled, on_progress):
+    tiles, _ = basemap_tiles_for_territories(territory_polygons_wm, zoom)
+    if not tiles: return None
+    xs = [x for _, x, _ in tiles]; ys = [y for _, _, y in tiles]
+    x_range, y_range = (min(xs), max(xs)), (min(ys), max(ys)); n_x, n_y = x_range[1] - x_range[0] + 1, y_range[1] - y_range[0] + 1
+    key = _mosaic_key(tile_source, zoom, x_range, y_range); meta = _read_meta(folder)
+    if meta is None or meta.get('key') != key or not os.path.exists(os.path.join(folder, MOSAIC_IMAGE_FILENAME)):
+        if meta is not None: log_emitter(f"  Basemap mosaic z{zoom}: tile source or territory extent changed; rebuilding.")
+        _close_mosaic(os.path.dirname(folder)); shutil.rmtree(folder, ignore_errors=True); os.makedirs(folder, exist_ok=True)
+        try: tile_size = _decode_tile(tile_source.get_tile(*tiles[0])).shape[0]
+        except Exception as tile_err: log_emitter(f"  Basemap mosaic z{zoom} skipped: first tile unavailable ({tile_err})."); return None
+        size_mb = n_x * n_y * tile_size * tile_size * 4 / (1 << 20)
+        if size_mb > budget_mb:
+            shutil.rmtree(folder, ignore_errors=True)
+            log_emitter(f"  Basemap mosaic z{zoom} skipped: {n_x}x{n_y} tiles would need {size_mb:.0f} MB, over BASEMAP_MOSAIC_MAX_MB ({config.BASEMAP_MOSAIC_MAX_MB})."); return None
+        meta = {'key': key, 'tile_size': tile_size, 'generation': 0}
+        np.lib.format.open_memmap(os.path.join(folder, MOSAIC_IMAGE_FILENAME), mode='w+', dtype=np.uint8, shape=(n_y * tile_size, n_x * tile_size, 4)).flush()
+        np.save(os.path.join(folder, MOSAIC_FILLED_FILENAME), np.zeros((n_y, n_x), dtype=bool))
+        log_emitter(f"  Basemap mosaic z{zoom}: new {n_x}x{n_y} tiles ({size_mb:.0f} MB) in {folder}")
+    tile_size = meta['tile_size']; filled = np.load(os.path.join(folder, MOSAIC_FILLED_FILENAME))
+    missing = [tile for tile in tiles if not filled[tile[2] - y_range[0], tile[1] - x_range[0]]]
+    if missing:
+        _close_mosaic(os.path.dirname(folder)); started = time.time(); failed = 0
+        image = np.load(os.path.join(folder, MOSAIC_IMAGE_FILENAME), mmap_mode='r+')
+        for done, (z, x, y) in enumerate(missing, 1):
+            if is_cancelled and is_cancelled(): break
+            try:
+                array = _decode_tile(tile_source.get_tile(z, x, y))
+                if array.shape != (tile_size, tile_size, 4): raise ValueError(f"tile is {array.shape[1]}x{array.shape[0]}, mosaic tiles are {tile_size}x{tile_size}")
+            except Exception: failed += 1; continue # Territories over this tile fall back to the tile source
+            row, column = (y - y_range[0]) * tile_size, (x - x_range[0]) * tile_size
+            image[row:row + tile_size, column:column + tile_size] = array; filled[y - y_range[0], x - x_range[0]] = True
+            if on_progress and (done % 50 == 0 or done == len(missing)): on_progress(done, len(missing))
+        image.flush(); del image
+        np.save(os.path.join(folder, MOSAIC_FILLED_FILENAME), filled)
+        meta['generation'] += 1; _write_meta(folder, meta)
+        log_emitter(f"  Basemap mosaic z{zoom}: decoded {len(missing) - failed} tiles ({failed} failed) in {time.time() - started:.1f}s; {int(filled.sum())}/{filled.size} tiles filled.")
+    else: log_emitter(f"  Basemap mosaic z{zoom}: reusing {folder} ({len(tiles)} tiles, nothing to add).")
+    return {'folder': folder, 'generation': meta['generation'], 'x0': x_range[0], 'y0': y_range[0], 'tile_size': tile_size, 'size_mb': n_x * n_y * tile_size * tile_size * 4 / (1 << 20)}
+
+def _close_mosaic(folder):
+    # Drops this process's memory map before the files are rewritten (Windows cannot replace a mapped file).
+    _open_mosaics.pop(os.path.abspath(folder), None)
+
+class BasemapMosaicSource:
+    # Stands in for a BasemapTileSource in add_basemap_from_tile_source: mosaic() returns a window of the
+    # pre-stitched raster for its zoom. Windows at a zoom without a layer, reaching past the layer, or covering
+    # a tile that failed to load use the tile source.
+    def __init__(self, descriptor, tile_source):
+        self.descriptor = descriptor; self.tile_source = tile_source
+        self.provider = tile_source.provider; self.stats = tile_source.stats
+        self.layers = {} # zoom -> (memory-mapped image, filled), opened on first use
+
+    def _layer(self, zoom):
+        if zoom not in self.layers:
+            folder = self.descriptor['layers'][zoom]['folder']
+            self.layers[zoom] = (np.load(os.path.join(folder, MOSAIC_IMAGE_FILENAME), mmap_mode='r'), np.load(os.path.join(folder, MOSAIC_FILLED_FILENAME)))
+        return self.layers[zoom]
+
+    def mosaic(self, left, bottom, right, top, zoom, check_cancelled=None):
+        d = self.descriptor['layers'].get(zoom)
+        if d is None: return self.tile_source.mosaic(left, bottom, right, top, zoom, check_cancelled)
+        image, filled = self._layer(zoom); tiles = tiles_for_bounds(left, bottom, right, top, zoom)
+        x_min, x_max = min(t.x for t in tiles) - d['x0'], max(t.x for t in tiles) - d['x0']
+        y_min, y_max = min(t.y for t in tiles) - d['y0'], max(t.y for t in tiles) - d['y0']
+        if (x_min < 0 or y_min < 0 or y_max >= filled.shape[0] or x_max >= filled.shape[1] or not filled[y_min:y_max + 1, x_min:x_max + 1].all()):
+            return self.tile_source.mosaic(left, bottom, right, top, zoom, check_cancelled)
+        size = d['tile_size']; self.stats['tiles'] += len(tiles); self.stats['mosaic_tiles'] += len(tiles)
+        window = image[y_min * size:(y_max + 1) * size, x_min * size:(x_max + 1) * size]
+        upper_left = mt.xy_bounds(mt.Tile(x_min + d['x0'], y_min + d['y0'], zoom)); lower_right = mt.xy_bounds(mt.Tile(x_max + d['x0'], y_max + d['y0'], zoom))
+        return window, (upper_left.left, lower_right.right, lower_right.bottom, upper_left.top)
+
+def _generations(descriptor):
+    return {zoom: layer['generation'] for zoom, layer in descriptor['layers'].items()}
+
+def open_basemap_mosaic(descriptor, tile_source):
+    # One set of open memory maps per mosaic folder and process; a newer generation of any layer replaces them.
+    folder = os.path.abspath(descriptor['folder']); source = _open_mosaics.get(folder)
+    if source is None or _generations(source.descriptor) != _generations(descriptor) or source.tile_source is not tile_source:
+        source = _open_mosaics[folder] = BasemapMosaicSource(descriptor, tile_source)
+    return source
@@ -0,0 +1,230 @@
+# Per-territory map image and ReportLab PDF; runs in the engine's thread or in a render process.
+import os
+import io
+import time
+import signal
+import threading
+import traceback
+import warnings
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import matplotlib
+matplotlib.use('Agg') # Figures are only ever saved, never shown; Agg is also safe in threads and render processes
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from shapely.geometry import box
+
+# --- ReportLab Imports ---
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Flowable
+from reportlab.lib.utils import ImageReader
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib.pagesizes import letter
+
+# --- Pillow (PIL) Import for map image encoding ---
+from PIL import Image as PILImage
+
+from territoryprinter import config
+from territoryprinter.addresses import ADDRESS_SORT_COLUMNS, ADDRESS_TABLE_COLUMNS
+from territoryprinter.address_table import address_table_mode, build_address_table
+from territoryprinter.instrumentation import StageTimer, peak_rss_mb, timed
+from territoryprinter.tiles import TILE_STAT_KEYS, empty_tile_stats, format_tile_stats, get_basemap_tile_source, add_basemap_from_tile_source
+
+# --- Per-Territory Rendering (worker thread or render process) ---
+RENDER_FORMAT_VERSION = 2 # Bump when a code change alters the PDF layout so the manifest rebuilds every territory
+def territory_pdf_filename(territory_name, territory_number, row_index):
+    safe_name = "".join(c if c.isalnum() or c in (' ', '-', '_') else '_' for c in territory_name).rstrip() or f"Territory_Row_{row_index}"
+    safe_number = "".join(c if c.isalnum() or c in ('-', '_') else '_' for c in territory_number).rstrip() or "NoNum"
+    return f"{safe_name}-{safe_number}.pdf"
+
+def render_config_fingerprint():
+    # Every setting that changes how a territory PDF looks; part of each territory's manifest hash (which also gets its basemap zoom).
+    provider = config.BASEMAP_PROVIDER
+    return {'format_version': RENDER_FORMAT_VERSION, 'map_image_dpi': config.MAP_IMAGE_DPI, 'figure_width_inches': config.FIGURE_WIDTH_INCHES,
+            'figure_map_height_inches': config.FIGURE_MAP_HEIGHT_INCHES,
+            'map_image_embed': [config.MAP_IMAGE_EMBED_FORMAT, config.MAP_IMAGE_JPEG_QUALITY, config.MAP_IMAGE_INDEXED_COLORS],
+            'address_table': [config.ADDRESS_TABLE_MODE, config.ADDRESS_TABLE_FAST_THRESHOLD, config.ADDRESS_COMPACT_COLUMNS],
+            'basemap_provider': [provider.get('name'), provider.get('url')], 'boundary_style': config.BOUNDARY_STYLE, 'mask_style': config.MASK_STYLE,
+            'base_normal_style': config.BASE_NORMAL_STYLE_ATTRS, 'title_style': config.TITLE_RL_STYLE_ATTRS, 'street_header_style': config.STREET_HEADER_RL_STYLE_ATTRS}
+
+# --- In-Memory Map Image (one reusable figure per render thread/process) ---
+MAP_IMAGE_PAD_INCHES = 0.02
+_map_figures = threading.local()
+
+def _reusable_map_axes():
+    # Built once per thread and size; cleared for each territory instead of creating a new figure.
+    # Figures are not registered with pyplot, so nothing has to be closed and threads never share one.
+    size = (config.FIGURE_WIDTH_INCHES, config.FIGURE_MAP_HEIGHT_INCHES, config.MAP_IMAGE_DPI)
+    state = getattr(_map_figures, 'state', None)
+    if state is None or state[0] != size:
+        fig = Figure(figsize=size[:2], dpi=size[2]); FigureCanvasAgg(fig)
+        state = _map_figures.state = (size, fig, fig.add_subplot())
+    _, fig, ax = state
+    ax.clear(); ax.set_axis_off()
+    return fig, ax
+
+def render_map_image(fig, pad_inches=MAP_IMAGE_PAD_INCHES, check_cancelled=None):
+    # Equivalent of savefig(bbox_inches='tight'): draw the canvas once and crop its RGB pixels to the tight bbox.
+    canvas = fig.canvas; canvas.draw()
+    if check_cancelled: check_cancelled()
+    rgba = np.asarray(canvas.buffer_rgba()); height, width = rgba.shape[:2]
+    tight = fig.get_tightbbox(canvas.get_renderer()).padded(pad_inches)
+    x0 = max(0, int(round(tight.x0 * fig.dpi))); x1 = min(width, int(round(tight.x1 * fig.dpi)))
+    y0 = max(0, height - int(round(tight.y1 * fig.dpi))); y1 = min(height, height - int(round(tight.y0 * fig.dpi)))
+    return PILImage.fromarray(np.ascontiguousarray(rgba[y0:y1, x0:x1, :3]))
+
+def map_image_reader(map_image):
+    # MAP_IMAGE_EMBED_FORMAT: 'lossless' embeds the RGB pixels (Flate), 'jpeg' passes a JPEG stream straight
+    # into the PDF, 'indexed' reduces the map to a palette first so the Flate stream compresses much better.
+    embed_format = config.MAP_IMAGE_EMBED_FORMAT
+    if embed_format == 'jpeg':
+        jpeg_buffer = io.BytesIO(); map_image.save(jpeg_buffer, 'JPEG', quality=config.MAP_IMAGE_JPEG_QUALITY, optimize=True); jpeg_buffer.seek(0)
+        return ImageReader(jpeg_buffer)
+    if embed_format == 'indexed':
+        map_image = map_image.quantize(colors=config.MAP_IMAGE_INDEXED_COLORS, method=PILImage.Quantize.FASTOCTREE).convert('RGB')
+    return ImageReader(map_image)
+
+class MapImageFlowable(Flowable):
+    # Draws an in-memory image; platypus' Image only takes file names and file objects.
+    def __init__(self, image_reader, width, height):
+        super().__init__(); self.image_reader = image_reader; self.width = width; self.height = height
+    def wrap(self, available_width, available_height): return self.width, self.height
+    def draw(self): self.canv.drawImage(self.image_reader, 0, 0, width=self.width, height=self.height)
+
+# --- Shared ReportLab Styles ---
+_pdf_paragraph_styles = {}
+
+def pdf_paragraph_styles():
+    # (title, normal, street header) built once per process for the current style config, not per territory.
+    key = repr((config.TITLE_RL_STYLE_ATTRS, config.BASE_NORMAL_STYLE_ATTRS, config.STREET_HEADER_RL_STYLE_ATTRS))
+    if key not in _pdf_paragraph_styles:
+        base_styles = getSampleStyleSheet()
+        title_rl_style = ParagraphStyle('TerritoryTitleInst', parent=base_styles['h1'], **config.TITLE_RL_STYLE_ATTRS)
+        normal_style_rl = ParagraphStyle('NormalSmallInst', parent=base_styles['Normal'], **config.BASE_NORMAL_STYLE_ATTRS)
+        street_header_rl_style = ParagraphStyle('StreetHeaderInst', parent=normal_style_rl, **config.STREET_HEADER_RL_STYLE_ATTRS)
+        _pdf_paragraph_styles.clear(); _pdf_paragraph_styles[key] = (title_rl_style, normal_style_rl, street_header_rl_style)
+    return _pdf_paragraph_styles[key]
+
+def build_render_task(territories_wm, position, projected_kml_gdf_wm, address_slices, output_folder, tile_config):
+    # Everything one territory needs, and nothing more: its polygon and its own address slice (table columns only).
+    return {'position': position, 'row_index': int(territories_wm['row_index'].iloc[position]), 'name': territories_wm['name'].iloc[position],
+            'number': territories_wm['number'].iloc[position], 'polygon_wm': territories_wm.geometry.iloc[position],
+            'addresses': None if projected_kml_gdf_wm.empty else pd.DataFrame(projected_kml_gdf_wm[ADDRESS_TABLE_COLUMNS].iloc[address_slices[position]]),
+            'zoom': int(territories_wm['basemap_zoom'].iloc[position]) if 'basemap_zoom' in territories_wm else config.BASEMAP_ZOOM,
+            'pdf_filename': territories_wm['pdf_filename'].iloc[position] if 'pdf_filename' in territories_wm else
+                            territory_pdf_filename(territories_wm['name'].iloc[position], territories_wm['number'].iloc[position], int(territories_wm['row_index'].iloc[position])),
+            'output_folder': output_folder, 'tile_config': tile_config}
+
+class RenderCancelled(Exception):
+    pass
+
+def render_territory(task, log_emitter, timer=None, check_cancelled=None):
+    # timer (a StageTimer) gets the basemap, mask, savefig, table_build and pdf_build stages. check_cancelled()
+    # raises RenderCancelled; it runs between tiles, around the figure draw and on every PDF page.
+    index, territory_name, territory_number, output_folder = task['row_index'], task['name'], task['number'], task['output_folder']
+    log_emitter(f"\nProcessing: {territory_name} - {territory_number} (Row {index})")
+    gdf_territory_wm = gpd.GeoDataFrame({"T": [territory_name]}, geometry=[task['polygon_wm']], crs=config.TARGET_CRS)
+    addresses = task['addresses']
+    if addresses is not None: log_emitter(f"    - Found {len(addresses)} KML addresses in territory.")
+    else: log_emitter("    - No KML data to filter.")
+
+    tile_source = get_basemap_tile_source(task['tile_config']); tile_stats_before = dict(tile_source.stats); tile_stats = empty_tile_stats()
+    log_emitter("  Generating map image...")
+    fig_map, ax_map = _reusable_map_axes()
+    basemap_added = False; check_cancelled = check_cancelled or (lambda: None)
+    with timed(timer, 'basemap'):
+        gdf_territory_wm.plot(ax=ax_map, edgecolor='none', facecolor='none', alpha=0)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", UserWarning)
+                add_basemap_from_tile_source(ax_map, tile_source, task['zoom'], attribution_size=6, interpolation='spline36', check_cancelled=check_cancelled)
+            basemap_added = True
+        except RenderCancelled: raise
+        except Exception as ctx_err: log_emitter(f"  Ctx Error for {territory_name}: {ctx_err}.")
+    for key in TILE_STAT_KEYS: tile_stats[key] = tile_source.stats[key] - tile_stats_before[key]
+    log_emitter(f"  Basemap tiles at zoom {task['zoom']}: {format_tile_stats(tile_stats)}")
+    with timed(timer, 'mask'):
+        if basemap_added:
+            try:
+                final_xlim,final_ylim=ax_map.get_xlim(),ax_map.get_ylim(); map_bounds=box(final_xlim[0],final_ylim[0],final_xlim[1],final_ylim[1])
+                terr_geom=gdf_territory_wm.geometry.iloc[0];
+                if not terr_geom.is_valid: terr_geom=terr_geom.buffer(0)
+                if terr_geom.is_valid: gpd.GeoDataFrame([1],geometry=[map_bounds.difference(terr_geom)],crs=gdf_territory_wm.crs).plot(ax=ax_map,**config.MASK_STYLE)
+            except Exception as mask_err: log_emitter(f"  Mask Error for {territory_name}: {mask_err}")
+        gdf_territory_wm.plot(ax=ax_map, **config.BOUNDARY_STYLE)
+    check_cancelled()
+    with timed(timer, 'savefig'): map_image = render_map_image(fig_map, check_cancelled=check_cancelled); ax_map.clear() # Drop the basemap array now rather than at the next territory
+    log_emitter(f"  Map image rendered: {map_image.width}x{map_image.height} px")
+
+    log_emitter("  Generating ReportLab PDF...")
+    pdf_output_file = os.path.join(output_folder, task['pdf_filename'])
+    doc = SimpleDocTemplate(pdf_output_file, pagesize=letter, leftMargin=0.5*inch, rightMargin=0.5*inch, topMargin=0.5*inch, bottomMargin=0.5*inch)
+    story = []
+    title_rl_style, normal_style_rl, street_header_rl_style = pdf_paragraph_styles()
+
+    story.append(Paragraph(f"{territory_name} - {territory_number}", title_rl_style))
+    if map_image.width > 0 and map_image.height > 0:
+        try:
+            actual_img_width_px, actual_img_height_px = map_image.size
+            img_aspect_ratio = actual_img_height_px / actual_img_width_px if actual_img_width_px > 0 else 1
+            img_draw_width = doc.width; img_draw_height = img_draw_width * img_aspect_ratio
+            max_img_height_on_page = doc.height - (title_rl_style.fontSize + title_rl_style.spaceAfter + 0.2*inch)
+            if img_draw_height > max_img_height_on_page:
+                img_draw_height = max_img_height_on_page
+                img_draw_width = img_draw_height / img_aspect_ratio if img_aspect_ratio > 0 else doc.width
+            map_img_rl = MapImageFlowable(map_image_reader(map_image), img_draw_width, img_draw_height)
+            story.append(map_img_rl); story.append(Spacer(1, 0.2*inch))
+        except Exception as img_err: log_emitter(f" Error PDF image for {territory_name}: {img_err}"); story.append(Paragraph("Map image error.", normal_style_rl))
+    else: story.append(Paragraph("Map image is empty.", normal_style_rl))
+
+    if addresses is not None and not addresses.empty:
+        with timed(timer, 'table_build'):
+            sorted_addresses = addresses.sort_values(by=ADDRESS_SORT_COLUMNS)
+
+            if not sorted_addresses.empty:
+                table_mode = address_table_mode(len(sorted_addresses))
+                if table_mode != 'paragraph': log_emitter(f"  Address table layout: {table_mode}")
+                story.append(build_address_table(sorted_addresses, doc.width, (title_rl_style, normal_style_rl, street_header_rl_style), mode=table_mode))
+            else: story.append(Paragraph("No addresses in territory.", normal_style_rl))
+    else: story.append(Paragraph("No KML data for table for this territory.", normal_style_rl))
+
+    check_cancelled()
+    with timed(timer, 'pdf_build'): doc.build(story, onFirstPage=lambda canvas, doc: check_cancelled(), onLaterPages=lambda canvas, doc: check_cancelled())
+    log_emitter(f"  Saved ReportLab PDF: {pdf_output_file}")
+    counts = {'addresses': 0 if addresses is None else len(addresses), 'tiles': tile_stats['tiles'], 'pages': doc.page}
+    return {'pdf_path': pdf_output_file, 'tile_stats': tile_stats, 'counts': counts}
+
+
+def run_render_task(task, log_emitter, is_cancelled=None):
+    # Returns a result dict (position, row_index, name, number, success, cancelled, pdf_path, tile_stats, counts, plus
+    # the wall_s/stages/peak_rss_mb instrumentation); a failing territory is logged and does not stop the batch.
+    result = {'position': task['position'], 'row_index': task['row_index'], 'name': task['name'], 'number': task['number'],
+              'success': False, 'cancelled': False, 'pdf_path': None, 'tile_stats': empty_tile_stats(), 'counts': {}}
+    def check_cancelled():
+        if is_cancelled and is_cancelled(): raise RenderCancelled()
+    timer = StageTimer(cpu_clock=time.thread_time); started = time.perf_counter()
+    try: result.update(render_territory(task, log_emitter, timer, check_cancelled)); result['success'] = True
+    except RenderCancelled: result['cancelled'] = True; log_emitter(f"  Cancelled: {task['name']} - {task['number']} (no PDF written)")
+    except Exception as row_err:
+        log_emitter(f"  --- Error row {task['row_index']} ({task['name']} - {task['number']}) ---")
+        log_emitter(f"  Details: {row_err}\n{traceback.format_exc()}")
+    result.update(wall_s=time.perf_counter() - started, stages=timer.stages, peak_rss_mb=peak_rss_mb())
+    return result
+
+_cancel_event = None # Set by the parent to stop running territories at their next checkpoint
+
+def _init_render_process(cancel_event=None):
+    # Ctrl+C is handled by the parent, which cancels queued territories and sets cancel_event for running ones.
+    global _cancel_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN); _cancel_event = cancel_event
+
+def _warm_render_process():
+    # Render service workers: load the render stack and build this thread's figure and styles before the first request.
+    _reusable_map_axes(); pdf_paragraph_styles()
+
+def _render_territory_in_process(task):
+    # Process-pool entry point: log lines are buffered and shipped back with the result.
+    log_lines = []
+    result = run_render_task(task, log_lines.append, _cancel_event.is_set if _cancel_event is not None else None); result['log_lines'] = log_lines
+    return result
@@ -0,0 +1,245 @@
+# Long-running local render service: `python -m territoryprinter serve --csv ... --kml ... --out ...`.
+# The territories, the projected addresses, their assignment to territories and the basemap tile sources are
+# loaded once and kept in memory, so a request for one territory only pays for that territory's render. Renders
+# queue onto a warm worker pool (a thread, or render processes), and the CSV and KML are watched and reloaded
+# when they change on disk; requests keep using the previous data until the reload is complete. HTTP API:
+#   GET  /status                   loaded inputs, renders in flight and request counts
+#   GET  /territories              one entry per territory: number, name, row_index, addresses, zoom, pdf, up_to_date
+#   GET  /territories/<number>     render and return that territory's PDF; ?row=<row_index> picks one of several
+#                                  territories with the same number, ?force=1 renders even when the PDF is up to date
+#   POST /reload                   reload the CSV and KML now
+import os
+import json
+import time
+import threading
+import traceback
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from territoryprinter import config
+
+def _ignore(*args): pass
+
+def _file_signature(path):
+    try: stat = os.stat(path); return (stat.st_mtime_ns, stat.st_size)
+    except OSError: return None
+
+class TerritoryNotFound(LookupError):
+    pass
+
+class AmbiguousTerritory(LookupError):
+    def __init__(self, number, candidates):
+        super().__init__(f"{len(candidates)} territories are numbered {number}; pass ?row=<row_index>"); self.candidates = candidates
+
+class ServiceState:
+    # One loaded generation of the inputs; never modified once built, so requests can hold on to it across a reload.
+    def __init__(self, generation, csv_signature, kml_signature, territories_wm, projected_kml_gdf_wm, address_slices, tile_config, manifest_entries):
+        self.generation = generation; self.loaded_at = time.time(); self.csv_signature = csv_signature; self.kml_signature = kml_signature
+        self.territories_wm = territories_wm; self.projected_kml_gdf_wm = projected_kml_gdf_wm; self.address_slices = address_slices
+        self.tile_config = tile_config; self.manifest_entries = manifest_entries
+        self.pdf_filenames = list(territories_wm['pdf_filename']) # Position -> PDF filename; assign_pdf_filenames keeps them unique
+        self.positions_by_number = {}
+        for position, number in enumerate(territories_wm['number']): self.positions_by_number.setdefault(number, []).append(position)
+
+class RenderService:
+    def __init__(self, csv_path, kml_path, output_folder, render_workers=config.RENDER_WORKER_PROCESSES, log_emitter=None):
+        self.csv_path = csv_path; self.kml_path = kml_path; self.output_folder = output_folder
+        self.render_workers = max(1, int(render_workers)); self.log = log_emitter or _ignore
+        self.state = None; self.reload_error = None
+        self.counts = {'requests': 0, 'rendered': 0, 'up_to_date': 0, 'failed': 0, 'reloads': 0}
+        self._lock = threading.Lock() # Guards counts, in-flight renders and the manifest file
+        self._reload_lock = threading.Lock(); self._in_flight = {}; self._in_flight_count = 0
+        self._stop = threading.Event(); self._watcher = None; self._cancel_event = None; self.executor = None
+
+    # --- Loading (same stages as RenderPipeline.run, without the UI callbacks) ---
+    def _load_state(self, generation):
+        import pandas as pd
+        from territoryprinter.engine import CSV_NA_VALUES
+        from territoryprinter.territories import prepare_territories, assign_addresses_to_territories
+        from territoryprinter.addresses import address_cache_folder, load_projected_kml_addresses, add_address_display_columns
+        from territoryprinter.tiles import basemap_tile_config, choose_basemap_zooms, get_basemap_tile_source
+        from territoryprinter.manifest import assign_pdf_filenames, load_manifest, plan_incremental_render
+        from territoryprinter.render import render_config_fingerprint
+        started = time.time(); csv_signature = _file_signature(self.csv_path); kml_signature = _file_signature(self.kml_path)
+        df = pd.read_csv(self.csv_path, keep_default_na=True, na_values=CSV_NA_VALUES)
+        if df.shape[1] <= max(config.TERRITORY_NAME_INDEX, config.TERRITORY_NUMBER_INDEX, config.BOUNDARY_COLUMN_INDEX):
+            raise ValueError("CSV columns mismatch.")
+        territories_wm = prepare_territories(df, self.log, report_path=os.path.join(self.output_folder, config.BOUNDARY_REPORT_FILENAME))
+        kml_bbox = tuple(territories_wm.geometry.to_crs("EPSG:4326").total_bounds) if config.KML_FILTER_TO_TERRITORY_BBOX and not territories_wm.empty else None
+        projected_kml_gdf_wm = load_projected_kml_addresses(self.kml_path, config.KML_ADDRESS_COMPONENT_TAGS, address_cache_folder(self.output_folder), self.log, bbox=kml_bbox)
+        projected_kml_gdf_wm = add_address_display_columns(projected_kml_gdf_wm)
+        address_slices = assign_addresses_to_territories(projected_kml_gdf_wm, territories_wm, self.log,
+                                                         report_path=os.path.join(self.output_folder, config.ASSIGNMENT_REPORT_FILENAME))
+        choose_basemap_zooms(territories_wm, self.log); assign_pdf_filenames(territories_wm, self.log)
+        _, manifest_entries = plan_incremental_render(territories_wm, projected_kml_gdf_wm, address_slices, self.output_folder,
+                                                      load_manifest(self.output_folder, self.log), render_config_fingerprint())
+        tile_config = basemap_tile_config()
+        if config.BASEMAP_MOSAIC_ENABLED and not territories_wm.empty:
+            from territoryprinter.mosaic import mosaic_folder, prepare_basemap_mosaic
+            tile_config['mosaic'] = prepare_basemap_mosaic(territories_wm.geometry, territories_wm['basemap_zoom'], get_basemap_tile_source(tile_config),
+                                                           mosaic_folder(self.output_folder), self.log, is_cancelled=self._stop.is_set)
+        self.log(f"Service inputs loaded in {time.time() - started:.1f}s: {len(territories_wm)} territories, {len(projected_kml_gdf_wm)} addresses.")
+        return ServiceState(generation, csv_signature, kml_signature, territories_wm, projected_kml_gdf_wm, address_slices, tile_config, manifest_entries)
+
+    def reload(self):
+        # Builds the next generation alongside the current one; a failed reload keeps serving the old data.
+        with self._reload_lock:
+            generation = (self.state.generation + 1) if self.state else 1
+            self.log(f"Loading {self.csv_path} and {self.kml_path} (generation {generation})...")
+            try: state = self._load_state(generation)
+            except Exception as load_err:
+                self.reload_error = f"{load_err}"; self.log(f"--- Reload failed: {load_err} ---\n{traceback.format_exc()}")
+                if self.state is None: raise
+                self.log(f"  Still serving generation {self.state.generation}."); return False
+            self.state = state; self.reload_error = None
+            with self._lock: self.counts['reloads'] += 1
+            return True
+
+    def _watch_inputs(self):
+        # Polls the CSV and KML; a change is acted on once the file has stopped changing for one poll interval.
+        pending = None
+        while not self._stop.wait(config.SERVICE_RELOAD_POLL_SECONDS):
+            state = self.state; signatures = (_file_signature(self.csv_path), _file_signature(self.kml_path))
+            if None in signatures or signatures == (state.csv_signature, state.kml_signature): pending = None; continue
+            if signatures != pending: pending = signatures; continue
+            self.log("Input files changed on disk; reloading."); pending = None
+            self.reload()
+
+    # --- Worker Pool ---
+    def start(self):
+        from territoryprinter.render import _init_render_process, _warm_render_process
+        self.reload()
+        if self.render_workers > 1:
+            mp_context = multiprocessing.get_context('spawn'); self._cancel_event = mp_context.Event()
+            self.executor = ProcessPoolExecutor(max_workers=self.render_workers, mp_context=mp_context, initializer=_init_render_process, initargs=(self._cancel_event,))
+        else: self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        for future in [self.executor.submit(_warm_render_process) for _ in range(self.render_workers)]: future.result() # Imports and figures ready before the first request
+        self._watcher = threading.Thread(target=self._watch_inputs, name="input-watcher", daemon=True); self._watcher.start()
+        self.log(f"Render service ready with {self.render_workers} {'process' if self.render_workers > 1 else 'thread'}{'es' if self.render_workers > 1 else ''}.")
+
+    def stop(self):
+        self._stop.set()
+        if self._cancel_event is not None: self._cancel_event.set()
+        if self.executor is not None: self.executor.shutdown(wait=True, cancel_futures=True)
+
+    # --- Requests ---
+    def territory_position(self, state, number, row_index=None):
+        positions = state.positions_by_number.get(number, [])
+        if row_index is not None: positions = [position for position in positions if int(state.territories_wm['row_index'].iloc[position]) == row_index]
+        if not positions: raise TerritoryNotFound(f"No territory numbered {number}" + (f" in CSV row {row_index}" if row_index is not None else ""))
+        if len(positions) > 1: raise AmbiguousTerritory(number, [self._describe(state, position) for position in positions])
+        return positions[0]
+
+    def _is_up_to_date(self, state, position, manifest=None):
+        # The PDF exists and the manifest on disk (batch runs write it too) has this generation's hash for it.
+        from territoryprinter.manifest import load_manifest
+        pdf_filename = state.pdf_filenames[position]; manifest = manifest or load_manifest(self.output_folder)
+        recorded = manifest['territories'].get(pdf_filename, {}).get('hash')
+        return recorded == state.manifest_entries[pdf_filename]['hash'] and os.path.exists(os.path.join(self.output_folder, pdf_filename))
+
+    def _describe(self, state, position):
+        territories_wm = state.territories_wm; pdf_filename = state.pdf_filenames[position]
+        return {'number': territories_wm['number'].iloc[position], 'name': territories_wm['name'].iloc[position],
+                'row_index': int(territories_wm['row_index'].iloc[position]), 'addresses': len(state.address_slices[position]),
+                'zoom': int(territories_wm['basemap_zoom'].iloc[position]), 'pdf': pdf_filename}
+
+    def territories(self):
+        from territoryprinter.manifest import load_manifest
+        state = self.state
+        with self._lock:
+            manifest = load_manifest(self.output_folder)
+            return [{**self._describe(state, position), 'up_to_date': self._is_up_to_date(state, position, manifest)} for position in range(len(state.territories_wm))]
+
+    def status(self):
+        state = self.state
+        with self._lock:
+            return {'generation': state.generation, 'loaded_at': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state.loaded_at)),
+                    'csv': self.csv_path, 'kml': self.kml_path, 'output_folder': self.output_folder, 'territories': len(state.territories_wm),
+                    'addresses': len(state.projected_kml_gdf_wm), 'render_workers': self.render_workers, 'in_flight': self._in_flight_count,
+                    'reload_error': self.reload_error, **self.counts}
+
+    def render(self, number, row_index=None, force=False):
+        # Blocks until the territory's PDF is written; returns {'pdf_path', 'rendered', 'wall_s', 'log_lines', ...}.
+        # Concurrent requests for the same territory (and data generation) share one render.
+        from territoryprinter.render import build_render_task, _render_territory_in_process
+        state = self.state; position = self.territory_position(state, number, row_index); key = (state.generation, position)
+        pdf_path = os.path.join(self.output_folder, state.pdf_filenames[position])
+        with self._lock:
+            self.counts['requests'] += 1
+            if not force and key not in self._in_flight and self._is_up_to_date(state, position):
+                self.counts['up_to_date'] += 1
+                return {**self._describe(state, position), 'pdf_path': pdf_path, 'rendered': False, 'wall_s': 0.0, 'log_lines': []}
+            future = self._in_flight.get(key); submitted = future is None
+            if submitted:
+                task = build_render_task(state.territories_wm, position, state.projected_kml_gdf_wm, state.address_slices, self.output_folder, state.tile_config)
+                future = self._in_flight[key] = self.executor.submit(_render_territory_in_process, task); self._in_flight_count += 1
+        # Outside the lock: a future that is already done runs the callback right here, and _render_finished takes the lock.
+        if submitted: future.add_done_callback(lambda done: self._render_finished(state, position, key, done))
+        result = future.result()
+        if not result['success']: raise RuntimeError("\n".join(result['log_lines'][-5:]))
+        return {**self._describe(state, position), 'pdf_path': result['pdf_path'], 'rendered': True, 'wall_s': round(result['wall_s'], 3),
+                'log_lines': result['log_lines']}
+
+    def _render_finished(self, state, position, key, future):
+        from territoryprinter.manifest import load_manifest, save_manifest
+        with self._lock:
+            self._in_flight.pop(key, None); self._in_flight_count -= 1
+            result = None if future.cancelled() or future.exception() else future.result()
+            if result is None or not result['success']: self.counts['failed'] += 1; return
+            self.counts['rendered'] += 1
+            # Re-read so a batch run into the same folder keeps its entries; only this territory's hash changes.
+            pdf_filename = state.pdf_filenames[position]; manifest = load_manifest(self.output_folder)
+            manifest['territories'][pdf_filename] = {'hash': state.manifest_entries[pdf_filename]['hash']}
+            try: save_manifest(self.output_folder, manifest)
+            except OSError as manifest_err: self.log(f"  Could not write render manifest: {manifest_err}")
+        self.log(f"Rendered {result['name']} - {result['number']} in {result['wall_s']:.2f}s: {result['pdf_path']}")
+
+# --- HTTP Front End ---
+class _ServiceRequestHandler(BaseHTTPRequestHandler):
+    service = None # Set on the subclass built by serve()
+
+    def _send(self, status, body, content_type, extra_headers=()):
+        self.send_response(status); self.send_header('Content-Type', content_type); self.send_header('Content-Length', str(len(body)))
+        for name, value in extra_headers: self.send_header(name, value)
+        self.end_headers(); self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, default=str, indent=1).encode('utf-8'), 'application/json')
+
+    def do_GET(self):
+        url = urlsplit(self.path); parts = [unquote(part) for part in url.path.strip('/').split('/') if part]; query = parse_qs(url.query)
+        try:
+            if parts == ['status']: return self._send_json(200, self.service.status())
+            if parts == ['territories']: return self._send_json(200, self.service.territories())
+            if len(parts) == 2 and parts[0] == 'territories':
+                row_index = int(query['row'][0]) if 'row' in query else None
+                result = self.service.render(parts[1], row_index=row_index, force=query.get('force', ['0'])[0] not in ('0', 'false', ''))
+                if query.get('format', ['pdf'])[0] == 'json': return self._send_json(200, result)
+                with open(result['pdf_path'], 'rb') as f: pdf = f.read()
+                return self._send(200, pdf, 'application/pdf', [('Content-Disposition', f'inline; filename="{os.path.basename(result["pdf_path"])}"'),
+                                                                ('X-Rendered', str(result['rendered']).lower()), ('X-Render-Seconds', str(result['wall_s']))])
+            self._send_json(404, {'error': f"Unknown path {url.path}"})
+        except TerritoryNotFound as not_found: self._send_json(404, {'error': str(not_found)})
+        except AmbiguousTerritory as ambiguous: self._send_json(409, {'error': str(ambiguous), 'candidates': ambiguous.candidates})
+        except ValueError as bad_request: self._send_json(400, {'error': str(bad_request)})
+        except Exception as render_err: self._send_json(500, {'error': str(render_err)})
+
+    def do_POST(self):
+        if urlsplit(self.path).path.strip('/') != 'reload': return self._send_json(404, {'error': f"Unknown path {self.path}"})
+        reloaded = self.service.reload()
+        self._send_json(200 if reloaded else 500, {'reloaded': reloaded, 'error': self.service.reload_error, **self.service.status()})
+
+    def log_message(self, format, *args):
+        self.service.log(f"{self.address_string()} {format % args}")
+
+def serve(service, host=None, port=None):
+    # Starts the service and answers requests until interrupted (Ctrl+C) or the server is shut down.
+    service.start()
+    handler = type('ServiceRequestHandler', (_ServiceRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host or config.SERVICE_HOST, config.SERVICE_PORT if port is None else port), handler); server.daemon_threads = True
+    service.log(f"Listening on http://{server.server_address[0]}:{server.server_address[1]}/ (GET /territories/<number> for a PDF)")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close(); service.stop()
@@ -0,0 +1,184 @@
+# Territory boundaries from the CSV and the one-pass assignment of addresses to them.
+import ast
+import json
+import warnings
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from territoryprinter import config
+
+# --- Boundary Parsing (whole CSV column at once) ---
+# A boundary cell holds a Python literal ([(lon, lat), ...], a list of rings for holes, or a list of polygons),
+# WKT, or GeoJSON (geometry, Feature or FeatureCollection). Polygons and multipolygons, holes included.
+_LITERAL_BRACKETS = str.maketrans('()', '[]')
+POLYGONAL_TYPE_IDS = (shapely.GeometryType.POLYGON, shapely.GeometryType.MULTIPOLYGON)
+
+def _parse_literal(boundary_str):
+    # Tuples become JSON arrays, which parse an order of magnitude faster than ast.literal_eval.
+    try: return json.loads(boundary_str.translate(_LITERAL_BRACKETS))
+    except ValueError: return ast.literal_eval(boundary_str)
+
+def _literal_depth(value):
+    depth = 0
+    while isinstance(value, (list, tuple)) and value: value = value[0]; depth += 1
+    return depth
+
+def _literal_polygons(boundary_strs, errors):
+    # Geometries for literal boundaries, built with one vectorized shapely call per level (rings, polygons,
+    # multipolygons); the per-row loop only flattens the nested lists. Returns {position: geometry}.
+    ring_coords, polygon_of_ring, row_of_polygon = [], [], []
+    for position, boundary_str in boundary_strs:
+        try:
+            value = _parse_literal(boundary_str); depth = _literal_depth(value)
+            if depth not in (2, 3, 4): raise ValueError("expected a list of points, of rings or of polygons")
+            polygons = [[value]] if depth == 2 else [value] if depth == 3 else value
+            rings = [np.asarray(ring, dtype=float) for polygon in polygons for ring in polygon]
+            if any(ring.ndim != 2 or ring.shape[1] < 2 or len(ring) < 3 for ring in rings): raise ValueError("every ring needs at least 3 (lon, lat) points")
+        except Exception as parse_err: errors.append((position, 'unparseable boundary', str(parse_err))); continue
+        for polygon in polygons:
+            for _ in polygon: polygon_of_ring.append(len(row_of_polygon))
+            row_of_polygon.append(position)
+        ring_coords.extend(ring[:, :2] for ring in rings)
+    if not ring_coords: return {}
+    ring_lengths = [len(ring) for ring in ring_coords]
+    rings = shapely.linearrings(np.concatenate(ring_coords), indices=np.repeat(np.arange(len(ring_coords)), ring_lengths))
+    polygons = shapely.polygons(rings, indices=polygon_of_ring)
+    row_of_polygon = np.asarray(row_of_polygon); positions, first_polygon, n_polygons = np.unique(row_of_polygon, return_index=True, return_counts=True)
+    geometries = dict(zip(positions.tolist(), polygons[first_polygon]))
+    multi = n_polygons > 1
+    if multi.any():
+        in_multi = np.isin(row_of_polygon, positions[multi])
+        geometries.update(zip(positions[multi].tolist(), shapely.multipolygons(polygons[in_multi], indices=np.unique(row_of_polygon[in_multi], return_inverse=True)[1])))
+    return geometries
+
+def _polygonal_parts(geometries):
+    # Polygon/MultiPolygon as is; collections (GeoJSON FeatureCollections, make_valid output) keep only their
+    # polygon area as a MultiPolygon; None where there is none.
+    geometries = np.asarray(geometries, dtype=object); result = np.full(len(geometries), None, dtype=object)
+    type_ids = shapely.get_type_id(geometries)
+    polygonal = np.isin(type_ids, POLYGONAL_TYPE_IDS) & ~shapely.is_empty(geometries)
+    result[polygonal] = geometries[polygonal]
+    collections = np.flatnonzero(type_ids == shapely.GeometryType.GEOMETRYCOLLECTION)
+    if len(collections):
+        parts, part_of = shapely.get_parts(geometries[collections], return_index=True)
+        parts, multi_part_of = shapely.get_parts(parts, return_index=True); part_of = part_of[multi_part_of] # Flatten nested multipolygons
+        keep = (shapely.get_type_id(parts) == shapely.GeometryType.POLYGON) & ~shapely.is_empty(parts)
+        if keep.any():
+            owners, owner_index = np.unique(part_of[keep], return_inverse=True)
+            result[collections[owners]] = shapely.multipolygons(parts[keep], indices=owner_index)
+    return result
+
+def parse_boundaries(boundary_strs):
+    # One geometry (EPSG:4326) per boundary string, None where it failed, plus [(position, reason, detail)].
+    boundary_strs = list(boundary_strs); geometries = np.full(len(boundary_strs), None, dtype=object); errors = []
+    first_chars = [boundary_str[:1] for boundary_str in boundary_strs]
+    literal = [(position, boundary_str) for position, (boundary_str, first) in enumerate(zip(boundary_strs, first_chars)) if first in '[(']
+    for position, geometry in _literal_polygons(literal, errors).items(): geometries[position] = geometry
+    for first, reader in (('{', shapely.from_geojson), (None, shapely.from_wkt)):
+        positions = [position for position, char in enumerate(first_chars) if (char == '{' if first else char not in '[({')]
+        if not positions: continue
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore") # Unreadable rows come back as None and are reported below
+            parsed = reader(np.array([boundary_strs[position] for position in positions], dtype=object), on_invalid='ignore')
+        for position, geometry in zip(positions, parsed):
+            if geometry is None: errors.append((position, 'unparseable boundary', "not a coordinate list, WKT or GeoJSON"))
+            else: geometries[position] = geometry
+    parsed_positions = np.flatnonzero(~shapely.is_missing(geometries))
+    if len(parsed_positions):
+        polygonal = _polygonal_parts(geometries[parsed_positions])
+        for position in parsed_positions[shapely.is_missing(polygonal)].tolist():
+            errors.append((position, 'not a polygon', f"{geometries[position].geom_type} without polygon area"))
+        geometries[parsed_positions] = polygonal
+    return geometries, errors
+
+def repair_geometries(geometries):
+    # Bulk make_valid of the invalid ones (a self-intersecting ring keeps both lobes, unlike buffer(0)).
+    # Returns (geometries, repaired positions, positions left without polygon area).
+    geometries = np.asarray(geometries, dtype=object).copy()
+    invalid = np.flatnonzero(~shapely.is_valid(geometries) & ~shapely.is_missing(geometries))
+    if not len(invalid): return geometries, invalid, invalid
+    geometries[invalid] = _polygonal_parts(shapely.make_valid(geometries[invalid]))
+    failed = shapely.is_missing(geometries[invalid])
+    return geometries, invalid[~failed], invalid[failed]
+
+def _territory_numbers(number_raw):
+    # As str(int(float(value))) per cell: numeric values lose their decimals, text stays as written, blanks become "NoNum".
+    numeric = pd.to_numeric(number_raw, errors='coerce').to_numpy(dtype=float)
+    return [("NoNum" if pd.isna(raw) else str(int(value)) if np.isfinite(value) else str(raw).strip()) for raw, value in zip(number_raw, numeric)]
+
+# --- Territory Preparation & Address Assignment ---
+def prepare_territories(df, log_emitter, report_path=None):
+    # One row per renderable CSV territory (row_index, name, number, raw boundary string, and zoom_override when
+    # the CSV has a BASEMAP_ZOOM_COLUMN_NAME column), boundaries parsed, repaired and projected to TARGET_CRS as
+    # whole columns. Rows that cannot be used are summarised in the log and listed (with the reason) in report_path.
+    name_raw = df.iloc[:, config.TERRITORY_NAME_INDEX]; number_raw = df.iloc[:, config.TERRITORY_NUMBER_INDEX]; boundary_raw = df.iloc[:, config.BOUNDARY_COLUMN_INDEX]
+    boundary_strs = boundary_raw.astype(object).where(boundary_raw.notna(), '').astype(str).str.strip()
+    rows = pd.DataFrame({'row_index': df.index, 'name': name_raw.astype(object).where(name_raw.notna(), '').astype(str).str.strip().to_numpy(),
+                         'number': _territory_numbers(number_raw), 'boundary': boundary_strs.to_numpy()})
+    if config.BASEMAP_ZOOM_COLUMN_NAME in df.columns: # Whole numbers only; anything else leaves the territory to the zoom policy
+        zoom_override = pd.to_numeric(df[config.BASEMAP_ZOOM_COLUMN_NAME], errors='coerce').to_numpy(dtype=float)
+        rows['zoom_override'] = np.where(np.isfinite(zoom_override) & (zoom_override == np.floor(zoom_override)), zoom_override, np.nan)
+    has_name = name_raw.notna().to_numpy(); has_boundary = boundary_raw.notna().to_numpy(); blank_boundary = has_boundary & (boundary_strs == '').to_numpy()
+    skipped = [(position, reason, '') for mask, reason in ((~has_name, 'missing name'), (has_name & ~has_boundary, 'missing boundary'), (has_name & blank_boundary, 'empty boundary'))
+               for position in np.flatnonzero(mask).tolist()] # (row position, reason, detail)
+    candidates = np.flatnonzero(has_name & has_boundary & ~blank_boundary)
+
+    geometries = np.full(len(rows), None, dtype=object)
+    parsed, parse_errors = parse_boundaries(rows['boundary'].to_numpy()[candidates])
+    skipped.extend((int(candidates[position]), reason, detail) for position, reason, detail in parse_errors)
+    geometries[candidates] = parsed; usable = np.flatnonzero(~shapely.is_missing(geometries))
+    geometries[usable], repaired, failed = repair_geometries(geometries[usable])
+    skipped.extend((int(position), 'invalid geometry', "no polygon area left after make_valid") for position in usable[failed])
+    usable = np.flatnonzero(~shapely.is_missing(geometries))
+    if len(repaired): log_emitter(f"  Repaired {len(repaired)} invalid boundaries (make_valid).")
+
+    territories = gpd.GeoDataFrame(rows.iloc[usable].reset_index(drop=True), geometry=list(geometries[usable]), crs="EPSG:4326")
+    territories_wm = territories.to_crs(config.TARGET_CRS) # One transform for every territory
+    projected, _, failed_wm = repair_geometries(territories_wm.geometry.to_numpy())
+    skipped.extend((int(position), 'invalid geometry', f"invalid after projection to {config.TARGET_CRS}") for position in usable[failed_wm])
+    territories_wm = territories_wm.set_geometry(gpd.GeoSeries(projected, crs=config.TARGET_CRS, index=territories_wm.index))
+    territories_wm = territories_wm[territories_wm.geometry.notna()].reset_index(drop=True)
+    if skipped: _report_skipped_boundaries(rows, skipped, log_emitter, report_path)
+    return territories_wm
+
+def _report_skipped_boundaries(rows, skipped, log_emitter, report_path):
+    positions, reasons, details = zip(*sorted(skipped))
+    report = rows.iloc[list(positions)].reset_index(drop=True)[['row_index', 'name', 'number']]
+    report['reason'] = reasons; report['detail'] = details; report['boundary'] = rows['boundary'].to_numpy()[list(positions)]
+    log_emitter(f"  Skipped {len(report)} CSV rows: " + ", ".join(f"{count} {reason}" for reason, count in report['reason'].value_counts().items()) + ".")
+    if not report_path: return
+    try: report.to_csv(report_path, index=False); log_emitter(f"  - Boundary error report written: {report_path}")
+    except Exception as report_err: log_emitter(f"  - Could not write boundary error report: {report_err}")
+
+def assign_addresses_to_territories(projected_gdf, territories_wm, log_emitter, report_path=None):
+    # One STRtree query of every address point against every territory polygon ('within', as the
+    # per-territory filter used). Returns, per territory, the positional indices of its addresses in
+    # their original order. Addresses in no territory or in several are logged and written to report_path.
+    n_territories = len(territories_wm)
+    if projected_gdf.empty or n_territories == 0: return [np.empty(0, dtype=np.intp) for _ in range(n_territories)]
+    log_emitter(f"Assigning {len(projected_gdf)} addresses to {n_territories} territories (spatial index)...")
+    tree = shapely.STRtree(territories_wm.geometry.to_numpy())
+    address_idx, territory_idx = tree.query(projected_gdf.geometry.to_numpy(), predicate='within')
+    order = np.lexsort((address_idx, territory_idx)); address_idx, territory_idx = address_idx[order], territory_idx[order]
+    bounds = np.searchsorted(territory_idx, np.arange(n_territories + 1))
+    address_slices = [address_idx[bounds[i]:bounds[i + 1]] for i in range(n_territories)]
+
+    territory_counts = np.bincount(address_idx, minlength=len(projected_gdf))
+    unassigned_idx = np.flatnonzero(territory_counts == 0); multiple_idx = np.flatnonzero(territory_counts > 1)
+    log_emitter(f"  - {len(projected_gdf) - len(unassigned_idx)} addresses assigned; {len(unassigned_idx)} in no territory; {len(multiple_idx)} in more than one territory.")
+    if report_path and (len(unassigned_idx) or len(multiple_idx)):
+        try:
+            labels = (territories_wm['name'] + " - " + territories_wm['number']).to_numpy()
+            multiple_pairs = np.isin(address_idx, multiple_idx)
+            territories_by_address = pd.Series(labels[territory_idx[multiple_pairs]]).groupby(address_idx[multiple_pairs]).agg("; ".join)
+            report_idx = np.concatenate([unassigned_idx, multiple_idx])
+            report = projected_gdf.iloc[report_idx].drop(columns=['house_number_prefix', 'house_number_rest_rank'], errors='ignore').to_crs("EPSG:4326")
+            report_df = pd.DataFrame({'status': ['no_territory'] * len(unassigned_idx) + ['multiple_territories'] * len(multiple_idx),
+                                      'territories': [''] * len(unassigned_idx) + territories_by_address.reindex(multiple_idx).tolist()})
+            report_df = pd.concat([report_df, report.drop(columns=report.geometry.name).reset_index(drop=True)], axis=1)
+            report_df['longitude'] = report.geometry.x.to_numpy(); report_df['latitude'] = report.geometry.y.to_numpy()
+            report_df.to_csv(report_path, index=False); log_emitter(f"  - Assignment report written: {report_path}")
+        except Exception as report_err: log_emitter(f"  - Could not write assignment report: {report_err}")
+    return address_slices
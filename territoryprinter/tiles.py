@@ -0,0 +1,312 @@
+# Basemap tiles: persistent disk cache, offline MBTiles/directory sources, prefetch and mosaicking.
+import os
+import io
+import re
+import math
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pandas as pd
+import matplotlib
+import mercantile as mt
+import requests
+from PIL import Image as PILImage
+
+from territoryprinter import config
+
+# --- Basemap Tile Source (persistent tile cache, offline MBTiles/directory, counters) ---
+TILE_STAT_KEYS = ('tiles', 'cache_hits', 'offline_hits', 'downloads', 'bytes_from_cache', 'bytes_offline', 'bytes_downloaded', 'evicted_files', 'mosaic_tiles')
+
+def empty_tile_stats():
+    return dict.fromkeys(TILE_STAT_KEYS, 0)
+
+def _format_bytes(n_bytes):
+    return f"{n_bytes / (1 << 20):.1f} MB" if n_bytes >= (1 << 20) else f"{n_bytes / 1024:.0f} KB"
+
+def format_tile_stats(stats):
+    return (f"{stats['tiles']} tiles ({stats['mosaic_tiles']} from mosaic, {stats['cache_hits']} cached, {stats['offline_hits']} offline, {stats['downloads']} downloaded); "
+            f"{_format_bytes(stats['bytes_from_cache'])} from cache, {_format_bytes(stats['bytes_offline'])} offline, "
+            f"{_format_bytes(stats['bytes_downloaded'])} downloaded, {stats['evicted_files']} evicted")
+
+def basemap_tile_config():
+    # Plain dict so it can be shipped to render processes along with each task.
+    return {'provider': config.BASEMAP_PROVIDER, 'cache_folder': config.BASEMAP_TILE_CACHE_FOLDER, 'cache_max_bytes': int(config.BASEMAP_TILE_CACHE_MAX_MB * 1024 * 1024),
+            'offline_source': config.BASEMAP_OFFLINE_SOURCE, 'timeout': config.BASEMAP_TILE_TIMEOUT_SECONDS, 'max_retries': config.BASEMAP_TILE_MAX_RETRIES}
+
+class TileDiskCache:
+    # provider/z/x/y tile bytes under one folder. A tile's mtime is its last use, so eviction
+    # (oldest first, down to 90% of the cap) is LRU and stays consistent across render processes.
+    def __init__(self, folder, max_bytes):
+        self.folder = folder; self.max_bytes = max_bytes; self._approx_bytes = None
+
+    def _tile_path(self, provider_key, z, x, y):
+        return os.path.join(self.folder, provider_key, str(z), str(x), f"{y}.tile")
+
+    def get(self, provider_key, z, x, y):
+        tile_path = self._tile_path(provider_key, z, x, y)
+        try:
+            with open(tile_path, 'rb') as f: data = f.read()
+        except FileNotFoundError: return None
+        try: os.utime(tile_path)
+        except OSError: pass
+        return data
+
+    def contains(self, provider_key, z, x, y):
+        return os.path.exists(self._tile_path(provider_key, z, x, y))
+
+    def put(self, provider_key, z, x, y, data):
+        tile_path = self._tile_path(provider_key, z, x, y)
+        os.makedirs(os.path.dirname(tile_path), exist_ok=True)
+        temp_path = f"{tile_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f: f.write(data)
+        os.replace(temp_path, tile_path)
+        if self._approx_bytes is None: self._approx_bytes = sum(size for _, size, _ in self._cached_files())
+        else: self._approx_bytes += len(data)
+        return self.evict() if self.max_bytes and self._approx_bytes > self.max_bytes else 0
+
+    def _cached_files(self):
+        for dir_path, _, file_names in os.walk(self.folder):
+            for file_name in file_names:
+                if not file_name.endswith('.tile'): continue
+                file_path = os.path.join(dir_path, file_name)
+                try: stat = os.stat(file_path)
+                except OSError: continue
+                yield stat.st_mtime, stat.st_size, file_path
+
+    def evict(self):
+        cached_files = sorted(self._cached_files()); total_bytes = sum(size for _, size, _ in cached_files)
+        target_bytes = int(self.max_bytes * 0.9); evicted = 0
+        for _, size, file_path in cached_files:
+            if total_bytes <= target_bytes: break
+            try: os.remove(file_path); total_bytes -= size; evicted += 1
+            except OSError: pass
+        self._approx_bytes = total_bytes
+        return evicted
+
+class MBTilesReader:
+    # Read-only tiles from an MBTiles (SQLite) file; rows are TMS, so y is flipped.
+    def __init__(self, mbtiles_path):
+        self.connection = sqlite3.connect(f"file:{mbtiles_path}?mode=ro", uri=True, check_same_thread=False)
+
+    def get(self, z, x, y):
+        row = self.connection.execute("SELECT tile_data FROM tiles WHERE zoom_level=? AND tile_column=? AND tile_row=?",
+                                      (z, x, (1 << z) - 1 - y)).fetchone()
+        return bytes(row[0]) if row else None
+
+class DirectoryTileReader:
+    # Read-only tiles from a {z}/{x}/{y}.<png|jpg|jpeg|webp> directory tree.
+    TILE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+    def __init__(self, root_folder):
+        self.root_folder = root_folder
+
+    def get(self, z, x, y):
+        for extension in self.TILE_EXTENSIONS:
+            tile_path = os.path.join(self.root_folder, str(z), str(x), f"{y}{extension}")
+            if os.path.exists(tile_path):
+                with open(tile_path, 'rb') as f: return f.read()
+        return None
+
+class TileFetchCancelled(Exception):
+    pass
+
+class BasemapTileSource:
+    # Tiles come from the offline source when one is configured (never the network), otherwise
+    # from the disk cache, falling back to a download that is then cached.
+    def __init__(self, provider, cache_folder=None, cache_max_bytes=0, offline_source=None, timeout=30, max_retries=3):
+        self.provider = provider
+        self.provider_key = re.sub(r'[^A-Za-z0-9_.-]+', '_', str(provider.get('name') or provider.get('url', 'tiles')))
+        self.cache = TileDiskCache(cache_folder, cache_max_bytes) if cache_folder else None
+        self.offline_source = offline_source; self.offline_reader = None
+        if offline_source:
+            self.offline_reader = DirectoryTileReader(offline_source) if os.path.isdir(offline_source) else MBTilesReader(offline_source)
+        self.timeout = timeout; self.max_retries = max_retries
+        self.stats = empty_tile_stats(); self._thread_state = threading.local()
+
+    def _download(self, z, x, y, check_cancelled=None):
+        # Safe to call from prefetch threads: each thread keeps its own requests session. check_cancelled()
+        # raises to abandon the tile; it runs before every attempt and during the retry backoff.
+        session = getattr(self._thread_state, 'session', None)
+        if session is None:
+            session = self._thread_state.session = requests.Session(); session.headers['User-Agent'] = config.BASEMAP_USER_AGENT
+        tile_url = self.provider.build_url(x=x, y=y, z=z)
+        for attempt in range(self.max_retries + 1):
+            if check_cancelled: check_cancelled()
+            try: response = session.get(tile_url, timeout=self.timeout)
+            except requests.RequestException:
+                if attempt == self.max_retries: raise
+            else:
+                if response.status_code == 404: raise requests.HTTPError(f"Tile URL resulted in a 404 error: {tile_url}")
+                if response.ok: return response.content
+                if attempt == self.max_retries: response.raise_for_status()
+            backoff_until = time.monotonic() + min(2 ** attempt, 8)
+            while time.monotonic() < backoff_until:
+                if check_cancelled: check_cancelled()
+                time.sleep(min(0.25, max(0.0, backoff_until - time.monotonic())))
+
+    def get_tile(self, z, x, y, check_cancelled=None):
+        if self.offline_reader is not None:
+            data = self.offline_reader.get(z, x, y)
+            if data is None: raise FileNotFoundError(f"Tile {z}/{x}/{y} is not in the offline source {self.offline_source}")
+            self.stats['offline_hits'] += 1; self.stats['bytes_offline'] += len(data); return data
+        if self.cache is not None:
+            data = self.cache.get(self.provider_key, z, x, y)
+            if data is not None: self.stats['cache_hits'] += 1; self.stats['bytes_from_cache'] += len(data); return data
+        data = self._download(z, x, y, check_cancelled)
+        self.stats['downloads'] += 1; self.stats['bytes_downloaded'] += len(data)
+        if self.cache is not None: self.stats['evicted_files'] += self.cache.put(self.provider_key, z, x, y, data)
+        return data
+
+    def mosaic(self, left, bottom, right, top, zoom, check_cancelled=None):
+        # Same tile set and stitching as contextily's bounds2img; returns (RGBA image, (left, right, bottom, top)) in EPSG:3857.
+        tiles = tiles_for_bounds(left, bottom, right, top, zoom)
+        arrays = []
+        for tile in tiles:
+            with PILImage.open(io.BytesIO(self.get_tile(tile.z, tile.x, tile.y, check_cancelled))) as tile_image: arrays.append(np.asarray(tile_image.convert('RGBA')))
+        self.stats['tiles'] += len(tiles)
+        tile_xys = np.array([(t.x, t.y) for t in tiles]); offsets = tile_xys - tile_xys.min(axis=0)
+        h, w, d = arrays[0].shape; n_x, n_y = (offsets + 1).max(axis=0)
+        image = np.zeros((h * n_y, w * n_x, d), dtype=np.uint8)
+        for (x, y), array in zip(offsets, arrays): image[y * h:(y + 1) * h, x * w:(x + 1) * w, :] = array
+        tile_bounds = np.array([mt.xy_bounds(t) for t in tiles])
+        return image, (tile_bounds[:, 0].min(), tile_bounds[:, 2].max(), tile_bounds[:, 1].min(), tile_bounds[:, 3].max())
+
+    def prefetch(self, tiles, max_workers, max_requests_per_second=0, is_cancelled=None, on_progress=None):
+        # Downloads the tiles missing from the disk cache on a bounded thread pool; writes happen on
+        # the calling thread. Returns (already_cached, downloaded, failed); tiles abandoned on cancellation are not failures.
+        missing = [tile for tile in tiles if not self.cache.contains(self.provider_key, *tile)]
+        already_cached, downloaded, failed = len(tiles) - len(missing), 0, 0
+        rate_limiter = RequestRateLimiter(max_requests_per_second)
+        def check_cancelled():
+            if is_cancelled and is_cancelled(): raise TileFetchCancelled()
+        def fetch(tile):
+            rate_limiter.wait(); return tile, self._download(*tile, check_cancelled=check_cancelled)
+        executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        try:
+            pending = {executor.submit(fetch, tile) for tile in missing}
+            while pending:
+                done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        (z, x, y), data = future.result(); downloaded += 1
+                        self.stats['downloads'] += 1; self.stats['bytes_downloaded'] += len(data)
+                        self.stats['evicted_files'] += self.cache.put(self.provider_key, z, x, y, data)
+                    except TileFetchCancelled: pass
+                    except Exception: failed += 1
+                if on_progress: on_progress(downloaded + failed, len(missing))
+                if is_cancelled and is_cancelled():
+                    for future in pending: future.cancel()
+                    break
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return already_cached, downloaded, failed
+
+class RequestRateLimiter:
+    # Spaces calls to wait() at least 1/requests_per_second apart across threads.
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._lock = threading.Lock(); self._next_slot = 0.0
+
+    def wait(self):
+        if not self.interval: return
+        with self._lock:
+            now = time.monotonic(); slot = max(now, self._next_slot); self._next_slot = slot + self.interval
+        if slot > now: time.sleep(slot - now)
+
+def tiles_for_bounds(left, bottom, right, top, zoom):
+    west, south = mt.lnglat(left, bottom); east, north = mt.lnglat(right, top)
+    return list(mt.tiles(west, south, east, north, [zoom]))
+
+def territory_map_extent(polygon_wm):
+    # The axis limits the render gets from plotting the territory: its bounds plus matplotlib's default margins.
+    min_x, min_y, max_x, max_y = polygon_wm.bounds
+    margin_x = (max_x - min_x) * matplotlib.rcParams['axes.xmargin']; margin_y = (max_y - min_y) * matplotlib.rcParams['axes.ymargin']
+    return min_x - margin_x, min_y - margin_y, max_x + margin_x, max_y + margin_y
+
+def basemap_tiles_for_territories(territory_polygons_wm, zooms):
+    # Deduplicated (z, x, y) set covering every territory's map at its zoom (one zoom for all, or one per
+    # territory); also returns the per-territory total.
+    unique_tiles = set(); requested = 0
+    zooms = [zooms] * len(territory_polygons_wm) if np.isscalar(zooms) else zooms
+    for polygon_wm, zoom in zip(territory_polygons_wm, zooms):
+        territory_tiles = tiles_for_bounds(*territory_map_extent(polygon_wm), int(zoom))
+        requested += len(territory_tiles); unique_tiles.update((t.z, t.x, t.y) for t in territory_tiles)
+    return sorted(unique_tiles), requested
+
+# --- Zoom Policy ---
+# 'adaptive' picks, per territory, the lowest zoom whose tiles still give BASEMAP_TARGET_PIXELS_PER_INCH across
+# the map as drawn on the figure, between BASEMAP_MIN_ZOOM and BASEMAP_ZOOM; 'fixed' always uses BASEMAP_ZOOM.
+# A whole number in the optional BASEMAP_ZOOM_COLUMN_NAME CSV column overrides either. Every territory is
+# then held to BASEMAP_MAX_TILES_PER_TERRITORY by zooming out.
+WEB_MERCATOR_WIDTH_METERS = 2 * math.pi * 6378137
+TILE_PIXELS = 256
+
+def _map_axes_inches():
+    # Size of the map axes on the figure, from the default subplot layout render.py draws into.
+    subplot = matplotlib.rcParams
+    return (config.FIGURE_WIDTH_INCHES * (subplot['figure.subplot.right'] - subplot['figure.subplot.left']),
+            config.FIGURE_MAP_HEIGHT_INCHES * (subplot['figure.subplot.top'] - subplot['figure.subplot.bottom']))
+
+def adaptive_zoom(map_extent, target_pixels_per_inch):
+    # Equal-aspect axes scale the extent to fit; zoom z puts TILE_PIXELS * 2**z pixels across the world's width.
+    left, bottom, right, top = map_extent; axes_width, axes_height = _map_axes_inches()
+    inches_per_meter = min(axes_width / max(right - left, 1e-9), axes_height / max(top - bottom, 1e-9))
+    return math.ceil(math.log2(target_pixels_per_inch * WEB_MERCATOR_WIDTH_METERS * inches_per_meter / TILE_PIXELS) - 1e-9)
+
+def territory_basemap_zoom(polygon_wm, zoom_override=None):
+    # (zoom, tiles at that zoom, how it was chosen: 'fixed', 'adaptive' or 'override', plus ', capped' when the budget applied).
+    map_extent = territory_map_extent(polygon_wm); max_zoom = int(config.BASEMAP_PROVIDER.get('max_zoom', config.BASEMAP_ZOOM))
+    if zoom_override is not None and not pd.isna(zoom_override): zoom, source = min(max(int(zoom_override), 0), max_zoom), 'override'
+    elif config.BASEMAP_ZOOM_POLICY == 'adaptive':
+        target = config.BASEMAP_TARGET_PIXELS_PER_INCH or config.MAP_IMAGE_DPI
+        zoom, source = min(max(adaptive_zoom(map_extent, target), config.BASEMAP_MIN_ZOOM), config.BASEMAP_ZOOM), 'adaptive'
+    else: zoom, source = config.BASEMAP_ZOOM, 'fixed'
+    n_tiles = len(tiles_for_bounds(*map_extent, zoom))
+    if config.BASEMAP_MAX_TILES_PER_TERRITORY and n_tiles > config.BASEMAP_MAX_TILES_PER_TERRITORY:
+        while zoom > 0 and n_tiles > config.BASEMAP_MAX_TILES_PER_TERRITORY: zoom -= 1; n_tiles = len(tiles_for_bounds(*map_extent, zoom))
+        source += ', capped'
+    return zoom, n_tiles, source
+
+def choose_basemap_zooms(territories_wm, log_emitter):
+    # Adds 'basemap_zoom' and 'basemap_tiles' columns to territories_wm and logs how the zooms were chosen.
+    overrides = territories_wm['zoom_override'] if 'zoom_override' in territories_wm else [None] * len(territories_wm)
+    choices = [territory_basemap_zoom(polygon_wm, override) for polygon_wm, override in zip(territories_wm.geometry, overrides)]
+    territories_wm['basemap_zoom'] = [zoom for zoom, _, _ in choices]; territories_wm['basemap_tiles'] = [n_tiles for _, n_tiles, _ in choices]
+    if not choices: return territories_wm
+    zoom_counts = territories_wm['basemap_zoom'].value_counts().sort_index(ascending=False)
+    log_emitter(f"Basemap zoom ({config.BASEMAP_ZOOM_POLICY} policy): " + ", ".join(f"z{zoom} x{count}" for zoom, count in zoom_counts.items())
+                + f"; {int(territories_wm['basemap_tiles'].sum())} tiles in total, at most {int(territories_wm['basemap_tiles'].max())} for one territory.")
+    sources = pd.Series([source for _, _, source in choices])
+    n_override = int(sources.str.startswith('override').sum()); n_capped = int(sources.str.endswith('capped').sum())
+    if n_override: log_emitter(f"  - {n_override} territories use the zoom from the '{config.BASEMAP_ZOOM_COLUMN_NAME}' column.")
+    if n_capped:
+        capped = territories_wm[sources.str.endswith('capped').to_numpy()]
+        log_emitter(f"  - {n_capped} territories zoomed out to stay within {config.BASEMAP_MAX_TILES_PER_TERRITORY} tiles: "
+                    + ", ".join(f"{name} - {number} (z{zoom})" for name, number, zoom in zip(capped['name'], capped['number'], capped['basemap_zoom'])))
+    return territories_wm
+
+_TILE_SOURCES = {}
+
+def get_basemap_tile_source(tile_config):
+    # One source (and disk cache bookkeeping) per process and configuration; wrapped by the mosaic when the run built one.
+    source_key = (str(tile_config['provider'].get('name')), tile_config['cache_folder'], tile_config['offline_source'])
+    if source_key not in _TILE_SOURCES:
+        _TILE_SOURCES[source_key] = BasemapTileSource(tile_config['provider'], tile_config['cache_folder'], tile_config['cache_max_bytes'],
+                                                      tile_config['offline_source'], tile_config['timeout'], tile_config['max_retries'])
+    if tile_config.get('mosaic'):
+        from territoryprinter.mosaic import open_basemap_mosaic # Deferred: mosaic builds on this module
+        return open_basemap_mosaic(tile_config['mosaic'], _TILE_SOURCES[source_key])
+    return _TILE_SOURCES[source_key]
+
+def add_basemap_from_tile_source(ax, tile_source, zoom, attribution_size=6, interpolation='spline36', check_cancelled=None):
+    # Drop-in for ctx.add_basemap(ax, crs=TARGET_CRS, ...) that reads tiles through tile_source.
+    xmin, xmax, ymin, ymax = ax.axis()
+    image, extent = tile_source.mosaic(xmin, ymin, xmax, ymax, zoom, check_cancelled)
+    ax.imshow(image, extent=extent, interpolation=interpolation, aspect=ax.get_aspect())
+    ax.axis((xmin, xmax, ymin, ymax))
+    attribution = tile_source.provider.get('attribution')
+    if attribution:
+        import contextily as ctx # Only for its attribution text box; deferred because importing it pulls in rasterio
+        ctx.add_attribution(ax, attribution, font_size=attribution_size)